@@ -0,0 +1,207 @@
+'''
+Benchmark the parser, writer, node lookup, spatial index and transforms on a
+synthetic board, and report the results as JSON.
+
+Usage: python -m benchmarks.bench [--modules N] [--pads N] [--segments N]
+                                  [--vias N] [--engines tokenizer,lazy,shlex]
+                                  [--workers N] [--output results.json]
+
+For every step, the report has the wall-clock time, the throughput in nodes
+per second (and MB per second for parsing and writing) and the peak resident
+memory of the process after the step.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from nodes.KicadPcbNode import KicadPcbNode, parse_file, write_file, find_all, PARSE_ENGINES
+from nodes.Module import Module, ModuleIndex
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.Transform2d import transform
+from quadtree.quadtree import Quadtree
+from quadtree.connectivity import ConnectivityGraph
+from benchmarks.synthetic import write_board
+
+# fraction of the modules that get_connected and the transforms start from
+CONNECTED_FRACTION = 0.1
+
+def count_nodes(nodes):
+    ''' Count the KicadPcbNodes in a tree. '''
+    count = 0
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(c for c in node.children if isinstance(c, KicadPcbNode))
+    return count
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class _Timer(object):
+    '''
+    Collects one result per timed step.
+    '''
+    def __init__(self):
+        self.results = []
+
+    def time(self, step, function, nodes=None, size_bytes=None):
+        start = time.time()
+        value = function()
+        seconds = time.time() - start
+
+        result = {'step': step, 'seconds': seconds, 'peak_rss_bytes': _peak_rss_bytes()}
+        if nodes is not None:
+            result['nodes'] = nodes
+            result['nodes_per_second'] = nodes / seconds if seconds else None
+        if size_bytes is not None:
+            result['mb_per_second'] = size_bytes / 1e6 / seconds if seconds else None
+        self.results.append(result)
+        return value
+
+def run(modules, pads, segments, vias, engines, work_dir, workers=None):
+    '''
+    Generate a board in work_dir, run every benchmark step on it and return
+    the report as a dict.
+    '''
+    timer = _Timer()
+    board_path = os.path.join(work_dir, 'synthetic.kicad_pcb')
+    timer.time('generate', lambda: write_board(board_path, modules=modules, pads=pads,
+                                               segments=segments, vias=vias))
+    size_bytes = os.path.getsize(board_path)
+
+    node_count = count_nodes(parse_file(board_path))
+
+    for engine in engines:
+        timer.time('parse_file[%s]' % engine, lambda: parse_file(board_path, engine=engine),
+                   nodes=node_count, size_bytes=size_bytes)
+
+    if workers:
+        timer.time('parse_file[tokenizer, %d workers]' % workers,
+                   lambda: parse_file(board_path, workers=workers),
+                   nodes=node_count, size_bytes=size_bytes)
+
+    nodes = parse_file(board_path)
+    found = timer.time('find_all', lambda: find_all(nodes, [Module, Segment, Via]),
+                       nodes=node_count)
+    board_objects = found[Module] + found[Segment] + found[Via]
+
+    module_index = timer.time('module_index_build', lambda: ModuleIndex(found[Module]),
+                              nodes=len(found[Module]))
+    references = [module.name for module in found[Module]]
+    timer.time('module_index_get', lambda: [module_index.get(name) for name in references],
+               nodes=len(references))
+    timer.time('module_index_matching',
+               lambda: [module_index.matching('SW%d([0-9]*)$' % i) for i in range(1, 101)],
+               nodes=100)
+
+    def _build_quadtree():
+        quadtree = Quadtree()
+        for board_object in board_objects:
+            quadtree.insert(board_object)
+        return quadtree
+    quadtrees = [('insert', timer.time('quadtree_build', _build_quadtree,
+                                       nodes=len(board_objects))),
+                 ('bulk_load', timer.time('quadtree_bulk_load',
+                                          lambda: Quadtree.bulk_load(board_objects),
+                                          nodes=len(board_objects))),
+                 ('hashgrid', timer.time('hashgrid_build',
+                                         lambda: Quadtree.bulk_load(board_objects,
+                                                                    backend='hashgrid'),
+                                         nodes=len(board_objects)))]
+
+    start_modules = found[Module][:max(int(len(found[Module]) * CONNECTED_FRACTION), 1)]
+    lookup_positions = [segment.get_start() for segment in found[Segment]]
+    for label, quadtree in quadtrees:
+        timer.time('get_connected[%s]' % label,
+                   lambda: quadtree.get_connected(start_modules),
+                   nodes=len(board_objects))
+        timer.time('lookup[%s]' % label,
+                   lambda: [quadtree.lookup(p) for p in lookup_positions],
+                   nodes=len(lookup_positions))
+
+    connectivity = timer.time('connectivity_build',
+                              lambda: ConnectivityGraph(board_objects),
+                              nodes=len(board_objects))
+    # the nodes that the transform and bulk_update steps move
+    connected = timer.time('get_connected[connectivity]',
+                           lambda: connectivity.get_connected(start_modules),
+                           nodes=len(board_objects))
+
+    # lookup_many and the bounding box queries don't depend on the backend,
+    # so they are timed on the bulk loaded Quadtree
+    static_quadtree = dict(quadtrees)['bulk_load']
+    timer.time('lookup_many', lambda: static_quadtree.lookup_many(lookup_positions),
+               nodes=len(lookup_positions))
+
+    rectangles = [(x - 5, y - 5, x + 5, y + 5) for x, y in lookup_positions]
+    timer.time('query_rectangles', lambda: static_quadtree.query_rectangles(rectangles),
+               nodes=len(rectangles))
+    timer.time('nearest_many',
+               lambda: static_quadtree.nearest_many(lookup_positions, k=3, types=Via),
+               nodes=len(lookup_positions))
+
+    timer.time('transform', lambda: transform(connected, t=(1.0, 2.0), r=10, rp=(5.0, 5.0)),
+               nodes=len(connected))
+    for label, quadtree in quadtrees:
+        timer.time('bulk_update[%s]' % label, lambda: quadtree.bulk_update(connected),
+                   nodes=len(connected))
+
+    output_path = os.path.join(work_dir, 'output.kicad_pcb')
+    timer.time('write_file', lambda: write_file(output_path, nodes),
+               nodes=node_count, size_bytes=size_bytes)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'board': {
+            'modules': modules,
+            'pads': pads,
+            'segments': segments,
+            'vias': vias,
+            'bytes': size_bytes,
+            'nodes': node_count,
+            'connected': len(connected),
+        },
+        'results': timer.results,
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark kicad_utils on a synthetic board.')
+    parser.add_argument('--modules', type=int, default=1000)
+    parser.add_argument('--pads', type=int, default=4)
+    parser.add_argument('--segments', type=int, default=4000)
+    parser.add_argument('--vias', type=int, default=1000)
+    parser.add_argument('--engines', default='tokenizer,lazy',
+                        help='comma separated parse engines out of %s' % ', '.join(PARSE_ENGINES))
+    parser.add_argument('--workers', type=int,
+                        help='also time parsing with this many worker processes')
+    parser.add_argument('--output', help='write the JSON report here instead of to stdout')
+    args = parser.parse_args(argv[1:])
+
+    work_dir = tempfile.mkdtemp(prefix='kicad_utils_bench')
+    try:
+        report = run(args.modules, args.pads, args.segments, args.vias,
+                     args.engines.split(','), work_dir, args.workers)
+    finally:
+        shutil.rmtree(work_dir)
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report_json + '\n')
+    else:
+        print(report_json)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,93 @@
+'''
+Check ConnectivityGraph.update against a graph built from scratch.
+
+Usage: python -m benchmarks.connectivity_check [trials] [modules]
+
+Every trial moves groups of nodes of a synthetic board by different
+transforms in one TransformSession, some of them by whole pitches so that
+they land on other pads and tracks, and updates the graph with every batch
+the session commits. get_connected of every module is then compared with
+that of a freshly built graph. Two tracks that meet at a point and are then
+pulled apart in the same session are checked first.
+'''
+import random
+import sys
+from nodes.KicadPcbNode import find_all, parse_string
+from nodes.Module import Module
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.Transform2d import TransformSession
+from quadtree.connectivity import ConnectivityGraph
+from benchmarks.synthetic import generate_board, MODULE_PITCH, PAD_PITCH
+
+MODULE_TEXT = '''
+(module check:PAD (layer F.Cu)
+  (at 0 0)
+  (fp_text reference M1 (at 0 0) (layer F.SilkS))
+  (pad 1 smd rect (at 0 0) (size 1 1) (layers F.Cu) (net 1 /N1))
+)
+'''
+
+def check_pulled_apart():
+    '''
+    Return 1 if two segments that meet at (5, 0) are still connected after
+    being moved apart in one session, 0 otherwise.
+    '''
+    module = Module(parse_string(MODULE_TEXT)[0])
+    a = Segment.new_segment(start=(0, 0), end=(5, 0), width=0.25, layer='F.Cu', net=1)
+    b = Segment.new_segment(start=(5, 0), end=(10, 0), width=0.25, layer='F.Cu', net=1)
+    connectivity = ConnectivityGraph([module, a, b])
+
+    session = TransformSession()
+    session.transform([module, a], t=(0, 3))
+    session.transform([b], t=(0, -3))
+    for batch in session.commit():
+        connectivity.update(batch)
+
+    expected = ConnectivityGraph([module, a, b]).get_connected([module])
+    return 0 if connectivity.get_connected([module]) == expected else 1
+
+def run_trial(rng, module_count):
+    '''
+    Run one trial and return the number of modules whose connected nodes
+    differ from those of a freshly built graph.
+    '''
+    nodes = generate_board(modules=module_count, segments=module_count * 8,
+                           vias=module_count)
+    found = find_all(nodes, [Module, Segment, Via])
+    board_objects = found[Module] + found[Segment] + found[Via]
+    connectivity = ConnectivityGraph(board_objects)
+
+    session = TransformSession()
+    for _ in range(rng.randint(2, 5)):
+        start = rng.sample(found[Module], rng.randint(1, 3))
+        group = connectivity.get_connected(start)
+        if rng.random() < 0.5:
+            # take part of the group along, to break some of its connections
+            group = rng.sample(list(group), max(len(group) // 2, 1))
+        if rng.random() < 0.5:
+            t = (rng.randint(-2, 2) * MODULE_PITCH, rng.randint(-2, 2) * PAD_PITCH)
+            session.transform(group, t=t)
+        else:
+            session.transform(group, t=(rng.uniform(-5, 5), rng.uniform(-5, 5)),
+                              r=rng.choice((-90, -10, 10, 90)),
+                              rp=rng.choice(start).get_position())
+    for batch in session.commit():
+        connectivity.update(batch)
+
+    fresh = ConnectivityGraph(board_objects)
+    return sum(1 for module in found[Module] \
+               if connectivity.get_connected([module]) != fresh.get_connected([module]))
+
+def main(argv):
+    trials = int(argv[1]) if len(argv) > 1 else 20
+    module_count = int(argv[2]) if len(argv) > 2 else 50
+
+    mismatches = check_pulled_apart()
+    rng = random.Random(0)
+    mismatches += sum(run_trial(rng, module_count) for _ in range(trials))
+    print('%d trials of %d modules: %d mismatched modules' % (trials, module_count, mismatches))
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
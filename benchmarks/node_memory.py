@@ -0,0 +1,110 @@
+'''
+Measure how many bytes a parsed board takes per KicadPcbNode.
+
+Usage: python -m benchmarks.node_memory [--baseline-rev REV] [--modules N]
+                                        [--segments N] [--vias N] [board]
+
+"before" is the KicadPcbNode class and parser of the git revision REV,
+which defaults to the first commit of the repository. "after" is the
+current KicadPcbNode as built by each parse engine. Without a board, a
+synthetic one is generated. Memory-mapped file contents are not counted,
+since they are backed by the file itself.
+'''
+import argparse
+import imp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from nodes.KicadPcbNode import KicadPcbNode, parse_file
+from benchmarks.synthetic import write_board
+
+def load_baseline(rev, work_dir):
+    '''
+    Load nodes/KicadPcbNode.py as of the git revision rev and return it as a
+    module.
+    '''
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source = subprocess.check_output(['git', 'show', '%s:nodes/KicadPcbNode.py' % rev],
+                                     cwd=repo_dir)
+    path = os.path.join(work_dir, 'baseline_KicadPcbNode.py')
+    with open(path, 'wb') as source_file:
+        source_file.write(source)
+    return imp.load_source('_baseline_KicadPcbNode', path)
+
+def get_first_rev():
+    ''' Return the first commit of the repository. '''
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    revs = subprocess.check_output(['git', 'rev-list', '--max-parents=0', 'HEAD'],
+                                   cwd=repo_dir)
+    return revs.split()[-1]
+
+def _iter_tree(nodes, node_class):
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        yield node
+        # look at the undecoded child list so that lazy nodes stay lazy
+        children = node._children if node_class is KicadPcbNode else node.children
+        stack.extend(c for c in children if isinstance(c, node_class))
+
+def measure(nodes, node_class=KicadPcbNode):
+    '''
+    Return (number of nodes, total bytes) for a tree of node_class nodes.
+    Objects shared between nodes are only counted once.
+    '''
+    seen = set()
+    def _sizeof(obj):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return sys.getsizeof(obj)
+
+    count = 0
+    total = 0
+    for node in _iter_tree(nodes, node_class):
+        count += 1
+        total += _sizeof(node)
+        if hasattr(node, '__dict__'):
+            total += _sizeof(node.__dict__)
+            children = node.children
+        else:
+            children = node._children
+            total += _sizeof(node._start) + _sizeof(node._end)
+        total += _sizeof(node.name) + _sizeof(children)
+        for child in children:
+            if not isinstance(child, node_class):
+                total += _sizeof(child)
+    return (count, total)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Measure the memory used per KicadPcbNode.')
+    parser.add_argument('board', nargs='?', help='kicad_pcb file (default: a synthetic board)')
+    parser.add_argument('--baseline-rev', help='git revision to compare with '
+                                               '(default: the first commit)')
+    parser.add_argument('--modules', type=int, default=1000)
+    parser.add_argument('--segments', type=int, default=10000)
+    parser.add_argument('--vias', type=int, default=1000)
+    args = parser.parse_args(argv[1:])
+
+    work_dir = tempfile.mkdtemp(prefix='kicad_utils_node_memory')
+    try:
+        board = args.board
+        if board is None:
+            board = os.path.join(work_dir, 'synthetic.kicad_pcb')
+            write_board(board, modules=args.modules, segments=args.segments, vias=args.vias)
+
+        baseline = load_baseline(args.baseline_rev or get_first_rev(), work_dir)
+        results = [('before', measure(baseline.parse_file(board), baseline.KicadPcbNode))]
+        results.append(('after (tokenizer)', measure(parse_file(board, engine='tokenizer'))))
+        results.append(('after (lazy)', measure(parse_file(board, engine='lazy'))))
+    finally:
+        shutil.rmtree(work_dir)
+
+    for label, (count, total) in results:
+        print('%-18s %9d nodes %12d bytes %8.1f bytes/node' %
+              (label, count, total, float(total) / max(count, 1)))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,98 @@
+'''
+Generate synthetic kicad_pcb boards of configurable size for benchmarking.
+
+Usage: python -m benchmarks.synthetic output.kicad_pcb [modules] [pads]
+                                       [segments] [vias]
+
+Modules are laid out on a grid. Segments are routed away from the pads in
+chains, so that every chain is connected to one pad, and vias are placed at
+the ends of the first segments, where those chains move to the bottom layer.
+'''
+import sys
+from nodes.KicadPcbNode import KicadPcbNode, parse_string, write_file
+from nodes.Segment import Segment
+from nodes.Via import Via
+
+MODULE_TEMPLATE = '''
+(module bench:SW_%(pad_count)d (layer F.Cu) (tedit 55C98A20) (tstamp 599A74A3)
+  (at %(x)s %(y)s)
+  (fp_text reference %(reference)s (at 0 6) (layer F.SilkS)
+    (effects (font (size 1 1) (thickness 0.15)))
+  )
+  (fp_text value SW (at 0 -6) (layer F.Fab)
+    (effects (font (size 1 1) (thickness 0.15)))
+  )
+  (fp_line (start -7 -7) (end 7 -7) (layer F.SilkS) (width 0.15))
+  (fp_line (start 7 -7) (end 7 7) (layer F.SilkS) (width 0.15))
+%(pads)s
+)
+'''
+
+PAD_TEMPLATE = '''  (pad %(number)d thru_hole circle (at %(x)s %(y)s) (size 2 2) (drill 1.2) (layers *.Cu *.Mask)
+    (net %(net)d /N%(net)d))'''
+
+MODULE_PITCH = 19.05
+PAD_PITCH = 2.54
+# how far each segment in a chain goes
+SEGMENT_STEP = (1.27, 2.54)
+LAYERS = ('F.Cu', 'B.Cu')
+
+def generate_board(modules=100, pads=4, segments=200, vias=50):
+    '''
+    Return a list holding the kicad_pcb root KicadPcbNode of a synthetic board.
+    '''
+    root = KicadPcbNode('kicad_pcb')
+    root.add_named_child('version', 4)
+    root.add_named_child('host', ['pcbnew', '"synthetic"'])
+
+    columns = max(int(modules ** 0.5), 1)
+    pad_positions = []
+    for i in range(modules):
+        x = round((i % columns) * MODULE_PITCH, 4)
+        y = round((i // columns) * MODULE_PITCH, 4)
+        pad_texts = []
+        for j in range(pads):
+            pad_x = round((j - (pads - 1) / 2.0) * PAD_PITCH, 4)
+            net = i * pads + j + 1
+            pad_texts.append(PAD_TEMPLATE % {'number': j + 1, 'x': pad_x, 'y': 0, 'net': net})
+            pad_positions.append((x + pad_x, y, net))
+        root.add_child(parse_string(MODULE_TEMPLATE % {'pad_count': pads,
+                                                       'x': x,
+                                                       'y': y,
+                                                       'reference': 'SW%d' % (i + 1),
+                                                       'pads': '\n'.join(pad_texts)})[0])
+
+    for i in range(segments):
+        if not pad_positions:
+            break
+        # the first len(pad_positions) segments start at a pad, the next ones
+        # continue the chains where the previous ones ended
+        pad_x, pad_y, net = pad_positions[i % len(pad_positions)]
+        step = i // len(pad_positions)
+        start = (round(pad_x + step * SEGMENT_STEP[0], 4), round(pad_y + step * SEGMENT_STEP[1], 4))
+        end = (round(start[0] + SEGMENT_STEP[0], 4), round(start[1] + SEGMENT_STEP[1], 4))
+        chain_has_via = i % len(pad_positions) < vias
+        layer = LAYERS[1] if step > 0 and chain_has_via else LAYERS[0]
+        root.add_child(Segment.new_segment(start=start, end=end, width=0.25,
+                                           layer=layer, net=net))
+        if i < vias:
+            root.add_child(Via.new_via(position=end, net=net))
+
+    return [root]
+
+def write_board(file_path, **kwargs):
+    '''
+    Generate a synthetic board and write it to file_path.
+    '''
+    write_file(file_path, generate_board(**kwargs))
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    sizes = [int(arg) for arg in argv[2:6]]
+    write_board(argv[1], **dict(zip(('modules', 'pads', 'segments', 'vias'), sizes)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,5 @@
+'''
+Command line tools for kicad_pcb files.
+
+Usage: python -m kicad_utils run script.py|recipe.json --boards 'boards/*.kicad_pcb' --jobs 8
+'''
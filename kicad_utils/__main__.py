@@ -0,0 +1,4 @@
+import sys
+from kicad_utils.batch import main
+
+sys.exit(main(sys.argv))
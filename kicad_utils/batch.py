@@ -0,0 +1,199 @@
+'''
+Apply a script to many kicad_pcb files with a pool of worker processes.
+
+A script is a Python file with a process(nodes) function, which changes the
+parsed nodes of a board in place, e.g. rotate_keys.py, or a recipe as
+described in kicad_utils.recipe, e.g. recipes/rotate_keys.json. Every board is
+parsed, processed and written in one worker, and a line with the timings or
+the error is printed as soon as it is done. Outputs are written to a
+temporary file first and then renamed, so a failed or interrupted run never
+leaves a half written board behind.
+
+Usage: python -m kicad_utils run script.py --boards 'boards/*.kicad_pcb'
+                                 [--boards ...] [--jobs N] [--output-dir DIR]
+                                 [--suffix SUFFIX] [--engine ENGINE] [--cache]
+'''
+import argparse
+import glob
+import imp
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from nodes.KicadPcbNode import parse_file, write_file, PARSE_ENGINES
+from nodes.ParseCache import ParseCache
+from kicad_utils.recipe import load_recipe, RECIPE_EXTENSIONS
+
+# name of the module the script is loaded as
+SCRIPT_MODULE_NAME = '_kicad_utils_script'
+# suffix of the output files when no output directory is given
+DEFAULT_SUFFIX = '-out'
+
+# the process function of the loaded script, one per process
+_process = None
+# the traceback of loading the script in a worker, if that failed
+_load_error = None
+
+def load_script(script_path):
+    '''
+    Load the script or recipe at script_path and return its process
+    function.
+    '''
+    if not os.path.isfile(script_path):
+        raise Exception('Script %s does not exist.' % script_path)
+    if os.path.splitext(script_path)[1].lower() in RECIPE_EXTENSIONS:
+        return load_recipe(script_path).process
+
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    if script_dir not in sys.path:
+        # let the script import the modules next to it, as if it were run
+        sys.path.insert(0, script_dir)
+    script = imp.load_source(SCRIPT_MODULE_NAME, script_path)
+    process = getattr(script, 'process', None)
+    if not callable(process):
+        raise Exception('%s does not define process(nodes).' % script_path)
+    return process
+
+def _init_worker(script_path):
+    global _process, _load_error # pylint: disable=global-statement
+    try:
+        _process = load_script(script_path)
+    except Exception: # pylint: disable=broad-except
+        # A pool replaces workers whose initializer raises, forever, so
+        # report the error with every board instead.
+        _load_error = traceback.format_exc()
+
+def get_output_path(board_path, output_dir=None, suffix=None):
+    '''
+    Return where to write the processed board_path: in output_dir if given,
+    otherwise next to it, with suffix added before the extension.
+    '''
+    if suffix is None:
+        suffix = '' if output_dir else DEFAULT_SUFFIX
+    directory, file_name = os.path.split(board_path)
+    name, extension = os.path.splitext(file_name)
+    return os.path.join(output_dir or directory, name + suffix + extension)
+
+def process_board(board_path, output_path, engine='tokenizer', cache=None):
+    '''
+    Parse board_path, run the loaded script on it and write it to
+    output_path. Returns the parse, process and write times in seconds.
+    '''
+    start = time.time()
+    nodes = parse_file(board_path, engine, cache)
+    parsed = time.time()
+    _process(nodes)
+    processed = time.time()
+
+    temp_path = '%s.%d.tmp' % (output_path, os.getpid())
+    try:
+        write_file(temp_path, nodes)
+        os.rename(temp_path, output_path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    written = time.time()
+    return (parsed - start, processed - parsed, written - processed)
+
+def _run_task(task):
+    '''
+    Process one board. Errors are returned rather than raised, so that the
+    other boards carry on.
+    '''
+    board_path, output_path, engine, use_cache = task
+    if _load_error is not None:
+        return (board_path, output_path, None, _load_error)
+    try:
+        cache = ParseCache() if use_cache else None
+        return (board_path, output_path, process_board(board_path, output_path, engine, cache),
+                None)
+    except Exception: # pylint: disable=broad-except
+        return (board_path, output_path, None, traceback.format_exc())
+
+def run(script_path, board_paths, jobs=1, output_dir=None, suffix=None, engine='tokenizer',
+        use_cache=False, out=sys.stdout):
+    '''
+    Apply the script at script_path to every board in board_paths with jobs
+    processes, writing a line per board to out as it finishes. Returns the
+    number of boards that failed.
+
+    The options and the script are checked before any board is processed,
+    and raise an Exception if they are unusable.
+    '''
+    global _process # pylint: disable=global-statement
+    if engine == 'lazy' and use_cache:
+        raise Exception('The lazy parse engine can not be used with a cache.')
+    # load the script here first, so that a broken script fails once rather
+    # than in every worker
+    _process = load_script(script_path)
+
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    tasks = [(board_path, get_output_path(board_path, output_dir, suffix), engine, use_cache)
+             for board_path in board_paths]
+
+    start = time.time()
+    if jobs > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)), _init_worker, (script_path,))
+        try:
+            results = pool.imap_unordered(_run_task, tasks)
+            failed = _report(results, out)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        failed = _report((_run_task(task) for task in tasks), out)
+
+    out.write('%d boards, %d failed, in %.2fs\n' % (len(tasks), failed, time.time() - start))
+    out.flush()
+    return failed
+
+def _report(results, out):
+    failed = 0
+    for board_path, output_path, times, error in results:
+        if error is None:
+            out.write('ok     %s -> %s (parse %.2fs, process %.2fs, write %.2fs)\n' %
+                      ((board_path, output_path) + times))
+        else:
+            failed += 1
+            out.write('FAILED %s\n%s' % (board_path, error))
+        out.flush()
+    return failed
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m kicad_utils',
+                                     description='Command line tools for kicad_pcb files.')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='apply a script to many boards')
+    run_parser.add_argument('script', help='Python file with a process(nodes) function, or a recipe')
+    run_parser.add_argument('--boards', action='append', required=True,
+                            help='glob of the boards to process; can be given more than once')
+    run_parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                            help='number of worker processes (default: number of CPUs)')
+    run_parser.add_argument('--output-dir',
+                            help='write the boards here instead of next to the inputs')
+    run_parser.add_argument('--suffix',
+                            help='added to the output file names (default: %r without '
+                                 '--output-dir, nothing with it)' % DEFAULT_SUFFIX)
+    run_parser.add_argument('--engine', default='tokenizer', choices=PARSE_ENGINES)
+    run_parser.add_argument('--cache', action='store_true',
+                            help='keep parsed boards in the default ParseCache')
+    args = parser.parse_args(argv[1:])
+    if args.engine == 'lazy' and args.cache:
+        run_parser.error('--cache can not be used with --engine lazy')
+
+    board_paths = sorted(set(path for pattern in args.boards for path in glob.glob(pattern)))
+    if not board_paths:
+        sys.stderr.write('No boards match %s.\n' % ', '.join(args.boards))
+        return 2
+
+    try:
+        failed = run(args.script, board_paths, args.jobs, args.output_dir, args.suffix,
+                     args.engine, args.cache)
+    except Exception as error: # pylint: disable=broad-except
+        sys.stderr.write('%s\n' % error)
+        return 2
+    return 1 if failed else 0
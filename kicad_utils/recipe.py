@@ -0,0 +1,269 @@
+'''
+Declarative transform recipes.
+
+A recipe names selections of modules and lists the transforms to apply to
+them, in order. It is written as JSON, or as YAML if PyYAML is installed:
+
+    {
+        "selections": {
+            "left_side": {"pattern": "[DS]([0-9]+):([0-9]+)", "group": 2, "max": 6,
+                          "names": ["SW1", "Y1"], "connected": true}
+        },
+        "transforms": [
+            {"select": "left_side", "rotate": -10, "pivot": {"module": "S1:6"}}
+        ]
+    }
+
+A selection has the modules whose reference is in names or matches pattern
+(from the start, like re.match). With group, the pattern only selects
+modules where that group is a number between min and max. With connected,
+every segment and via connected to the modules is selected too, optionally
+only those on nets.
+
+A transform selects one selection or a list of them and has translate,
+rotate and pivot, which are passed on to transform(). translate is [dx, dy]
+or {"from": point, "to": point, "axes": "x"}, moving from onto to along the
+given axes (default "xy"). A point is [x, y] or {"module": reference,
+"offset": [dx, dy]}, and a module point is where that module is after the
+transforms before it.
+
+Compiling a recipe for a board resolves every selection once. Running the
+plan adds the transforms to one TransformSession, so every node is moved
+and rounded once, and then updates the connectivity once for every group of
+nodes that moved the same way.
+
+Usage:
+    recipe = load_recipe('recipes/rotate_keys.json')
+    recipe.process(nodes)
+or
+    python -m kicad_utils run recipes/rotate_keys.json --boards 'boards/*.kicad_pcb'
+'''
+import json
+import os
+import re
+from nodes.KicadPcbNode import find_all
+from nodes.Module import Module, ModuleIndex
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.Transform2d import TransformSession
+from quadtree.connectivity import ConnectivityGraph
+
+RECIPE_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+_RECIPE_KEYS = ('selections', 'transforms')
+_SELECTION_KEYS = ('names', 'pattern', 'group', 'min', 'max', 'connected', 'nets')
+_TRANSFORM_KEYS = ('select', 'translate', 'rotate', 'pivot')
+_TRANSLATE_KEYS = ('from', 'to', 'axes')
+_POINT_KEYS = ('module', 'offset')
+_AXES = ('x', 'y', 'xy')
+
+# kinds of resolved translations in a Plan step
+_OFFSET = 'offset'
+_BETWEEN = 'between'
+
+def load_recipe(recipe_path):
+    '''
+    Load a Recipe from a JSON or YAML file.
+    '''
+    extension = os.path.splitext(recipe_path)[1].lower()
+    if extension not in RECIPE_EXTENSIONS:
+        raise Exception('%s is not a recipe, the extension must be one of %s.' %
+                        (recipe_path, ', '.join(RECIPE_EXTENSIONS)))
+    with open(recipe_path, 'r') as recipe_file:
+        if extension == '.json':
+            data = json.load(recipe_file)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise Exception('PyYAML is needed to load %s.' % recipe_path)
+            data = yaml.safe_load(recipe_file)
+    return Recipe(data)
+
+class Recipe(object):
+    '''
+    A checked recipe, which can be compiled into a Plan for a board.
+    '''
+    def __init__(self, data):
+        _check_keys('recipe', data, _RECIPE_KEYS)
+        self.selections = data.get('selections', {})
+        self.transforms = data.get('transforms', [])
+
+        for name, selection in self.selections.items():
+            _check_keys('selection %s' % name, selection, _SELECTION_KEYS)
+            if 'pattern' in selection:
+                re.compile(selection['pattern'])
+            elif 'group' in selection:
+                raise Exception('Selection %s has a group but no pattern.' % name)
+        for transform in self.transforms:
+            _check_keys('transform', transform, _TRANSFORM_KEYS)
+            for name in _as_list(transform.get('select')):
+                if name not in self.selections:
+                    raise Exception('Transform selects %s, which is not a selection.' % name)
+            translate = transform.get('translate')
+            if isinstance(translate, dict):
+                _check_keys('translate', translate, _TRANSLATE_KEYS)
+                if 'from' not in translate or 'to' not in translate:
+                    raise Exception('Translate needs both from and to.')
+                _check_point(translate['from'])
+                _check_point(translate['to'])
+                if translate.get('axes', 'xy') not in _AXES:
+                    raise Exception('Translate axes must be one of %s, got %r.' %
+                                    (', '.join(_AXES), translate['axes']))
+            elif translate is not None and not _is_pair(translate):
+                raise Exception('Translate %r must be [dx, dy] or have from and to.' %
+                                (translate,))
+            if 'pivot' in transform:
+                _check_point(transform['pivot'])
+
+    def compile(self, nodes, connectivity=None):
+        '''
+        Resolve the selections and points of the recipe for a parsed board.
+        If connectivity is given, it is used for connected selections and
+        updated when the plan is run; otherwise one is built if needed.
+        '''
+        found = find_all(nodes, [Module, Segment, Via])
+        module_index = ModuleIndex(found[Module])
+
+        if connectivity is None and any(s.get('connected') for s in self.selections.values()):
+            connectivity = ConnectivityGraph(found[Module] + found[Segment] + found[Via])
+
+        selected = {}
+        for name, selection in self.selections.items():
+            selected[name] = _select(selection, module_index, connectivity)
+
+        def _get_module(name):
+            module = module_index.get(name)
+            if module is None:
+                raise Exception('The board has no module %s.' % name)
+            return module
+
+        steps = []
+        for transform in self.transforms:
+            targets = set()
+            for name in _as_list(transform.get('select')):
+                targets.update(selected[name])
+            translate = transform.get('translate', (0, 0))
+            if isinstance(translate, dict):
+                translate = (_BETWEEN, _resolve_point(translate['from'], _get_module),
+                             _resolve_point(translate['to'], _get_module),
+                             translate.get('axes', 'xy'))
+            else:
+                translate = (_OFFSET, tuple(translate))
+            pivot = _resolve_point(transform.get('pivot', (0, 0)), _get_module)
+            steps.append((list(targets), translate, transform.get('rotate', 0), pivot))
+        return Plan(steps, connectivity)
+
+    def process(self, nodes):
+        '''
+        Apply the recipe to a parsed board, so that a recipe can be used
+        wherever a script's process function can.
+        '''
+        self.compile(nodes).run()
+
+class Plan(object):
+    '''
+    The transforms of a recipe with the selections resolved for one board.
+    '''
+    def __init__(self, steps, connectivity=None):
+        # list of (nodes, translate, rotation, pivot), where pivot and a
+        # translate of (_BETWEEN, from, to, axes) are still to be resolved
+        # against the pending positions; other translates are (_OFFSET, t)
+        self.steps = steps
+        self.connectivity = connectivity
+
+    def run(self):
+        '''
+        Apply the transforms and return the list of transformed nodes.
+        '''
+        session = TransformSession()
+        try:
+            for targets, translate, rotation, pivot in self.steps:
+                if translate[0] == _BETWEEN:
+                    _, start, end, axes = translate
+                    start = _get_point(session, start)
+                    end = _get_point(session, end)
+                    t = (end[0] - start[0] if 'x' in axes else 0,
+                         end[1] - start[1] if 'y' in axes else 0)
+                else:
+                    t = translate[1]
+                session.transform(targets, t=t, r=rotation,
+                                  rp=_get_point(session, pivot))
+        except:
+            session.discard()
+            raise
+
+        batches = session.commit()
+        if self.connectivity is not None:
+            # update only keeps the connections of nodes that moved together
+            for batch in batches:
+                self.connectivity.update(batch)
+        return [node for batch in batches for node in batch]
+
+def _select(selection, module_index, connectivity):
+    selected = set()
+    for name in selection.get('names', []):
+        module = module_index.get(name)
+        if module is None:
+            raise Exception('The board has no module %s.' % name)
+        selected.add(module)
+
+    if 'pattern' in selection:
+        pattern = re.compile(selection['pattern'])
+        group = selection.get('group')
+        low = selection.get('min')
+        high = selection.get('max')
+        for module in module_index.matching(pattern):
+            if group is not None:
+                value = int(pattern.match(module.name).group(group))
+                if (low is not None and value < low) or (high is not None and value > high):
+                    continue
+            selected.add(module)
+
+    if selection.get('connected'):
+        nets = selection.get('nets')
+        selected = connectivity.get_connected(selected, nets=set(nets) if nets else None)
+    return selected
+
+def _resolve_point(point, get_module):
+    '''
+    Return (module, offset) for a point, with module None for a fixed point.
+    '''
+    if isinstance(point, dict):
+        return (get_module(point['module']), tuple(point.get('offset', (0, 0))))
+    return (None, tuple(point))
+
+def _get_point(session, point):
+    module, (x, y) = point
+    if module is None:
+        return (x, y)
+    module_x, module_y = session.transform_point(module, module.x, module.y)
+    return (module_x + x, module_y + y)
+
+def _check_keys(what, data, allowed_keys):
+    if not isinstance(data, dict):
+        raise Exception('The %s must be a mapping, got %r.' % (what, data))
+    unknown = sorted(set(data) - set(allowed_keys))
+    if unknown:
+        raise Exception('Unknown keys in the %s: %s.' % (what, ', '.join(unknown)))
+
+def _check_point(point):
+    if isinstance(point, dict):
+        _check_keys('point', point, _POINT_KEYS)
+        if 'module' not in point:
+            raise Exception('Point %r has an offset but no module.' % point)
+        if 'offset' in point and not _is_pair(point['offset']):
+            raise Exception('Offset %r must be [dx, dy].' % (point['offset'],))
+    elif not _is_pair(point):
+        raise Exception('Point %r must be [x, y] or have a module.' % (point,))
+
+def _is_pair(value):
+    return isinstance(value, (list, tuple)) and len(value) == 2 and \
+           all(isinstance(v, (int, long, float)) and not isinstance(v, bool) for v in value)
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        return [value]
+    return list(value)
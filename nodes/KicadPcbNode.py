@@ -2,12 +2,27 @@
 Classes and functions related to .kicad_pcb files. Includes a KicadPcbNode
 class and functions to parse and write .kicad_pcb files.
 '''
+import logging
+import mmap
+import os
 import shlex
-from nodes.Transform2d import Transformable
+from nodes.Tokenizer import tokenize, tokenize_spans, read_token, skip_node, OPEN, ATOM, CLOSE
+from nodes.Transform2d import Transformable, get_open_sessions
 from numbers import Number
 
 OUTPUT_INDENT_SIZE = 2
 
+_logger = logging.getLogger(__name__)
+
+# Node names are shared between all nodes with the same name; a board has
+# millions of nodes but only a few dozen distinct names.
+_NAMES = {}
+
+# Nodes with fewer children than this are searched linearly by name, which is
+# as fast as a dict lookup at that size and saves building an index for every
+# small node on the board.
+_INDEX_THRESHOLD = 16
+
 class KicadPcbNode(object):
     '''
     Represents a node in the kicad_pcb hierarchy.
@@ -18,11 +33,82 @@ class KicadPcbNode(object):
         - ints
         - floats
         - KicadPcbNodes
+
+    Nodes built by the 'lazy' parse engine keep their atoms undecoded in the
+    memory-mapped source file until children is first accessed. They also
+    remember where they came from so that write_file can copy them verbatim
+    unless they have been changed.
     '''
+    # A large board has millions of nodes, so don't give each one a __dict__.
+    __slots__ = ('name', '_children', '_index', '_wrappers',
+                 '_source', '_undecoded', '_start', '_end')
 
     def __init__(self, name):
-        self.name = name
-        self.children = []
+        self.name = _NAMES.setdefault(name, name)
+        self._children = _new_child_list(self)
+        # name -> list of child KicadPcbNodes; built on demand, see
+        # get_children_with_name
+        self._index = None
+        # node_class -> list of node_class wrappers of our children; see find_all
+        self._wrappers = None
+        # For nodes parsed by the 'lazy' engine, the _SourceFile they were
+        # parsed from and the offsets of their opening paren and just past
+        # their closing paren in it.
+        self._source = None
+        self._start = None
+        self._end = None
+        # Set while this node's atoms are still undecoded. In that case
+        # _children only holds the child KicadPcbNodes.
+        self._undecoded = False
+
+    @property
+    def children(self):
+        '''
+        The heterogeneous list of this node's children.
+        '''
+        if self._undecoded:
+            self._decode()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._undecoded = False
+        self._children = _new_child_list(self, children)
+        self._children_changed()
+
+    def _children_changed(self):
+        '''
+        Called by our child list whenever it is modified.
+        '''
+        self._index = None
+        self._wrappers = None
+        if self._source is not None:
+            self._source.dirty.add(self)
+
+    def _decode(self):
+        '''
+        Decode this node's atoms from its source, interleaving them with the
+        already built child nodes.
+        '''
+        source = self._source.buffer
+        child_nodes = iter(self._children)
+        children = _new_child_list(self)
+
+        # skip over our own opening paren and name
+        _, _, pos = read_token(source, self._start)
+        while True:
+            event, value, pos = read_token(source, pos)
+            if event == ATOM:
+                _append(children, _coerce_atom(value))
+            elif event == OPEN:
+                child_node = next(child_nodes)
+                _append(children, child_node)
+                pos = child_node._end
+            else:
+                break
+
+        self._children = children
+        self._undecoded = False
 
     def add_child(self, child):
         '''
@@ -48,8 +134,20 @@ class KicadPcbNode(object):
         Return a list of children of this KicadPcbNode that are themselves
         KicadPcbNodes and that have the specified name.
         '''
-        return [c for c in self.children \
-                if isinstance(c, KicadPcbNode) and c.name == name]
+        # _children always holds every child node, even before decoding
+        children = self._children
+        if len(children) < _INDEX_THRESHOLD:
+            return [c for c in children \
+                    if isinstance(c, KicadPcbNode) and c.name == name]
+
+        index = self._index
+        if index is None:
+            index = {}
+            for child in children:
+                if isinstance(child, KicadPcbNode):
+                    index.setdefault(child.name, []).append(child)
+            self._index = index
+        return list(index.get(name, ()))
 
     def get_child_with_name(self, name):
         '''
@@ -117,23 +215,112 @@ class KicadPcbNode(object):
             raise NotImplementedError(('There are multiple children with the name %s.' +
                                        ' Not supported for now.') % key)
 
+    def __getstate__(self):
+        # Only the name and the (decoded) children are kept, so copies are
+        # plain nodes that don't depend on the source file.
+        return (self.name, list(self.children))
+
+    def __setstate__(self, state):
+        name, children = state
+        self.name = _NAMES.setdefault(name, name)
+        self._children = _new_child_list(self, children)
+        self._index = None
+        self._wrappers = None
+        self._source = None
+        self._start = None
+        self._end = None
+        self._undecoded = False
+
     def __str__(self):
         return '<%s> %s' % (self.name, [c.__str__() for c in self.children])
 
+_append = list.append
+
+class _ChildList(list):
+    '''
+    The list behind KicadPcbNode.children. It tells its owner whenever it is
+    modified so that the owner's name index never goes stale. Renaming a child
+    node in place is not noticed.
+    '''
+    __slots__ = ('_owner',)
+
+    def append(self, child):
+        _append(self, child)
+        owner = self._owner
+        index = owner._index
+        owner._children_changed()
+        # appending is by far the most common edit; keep the index if we can
+        if index is not None and isinstance(child, KicadPcbNode):
+            index.setdefault(child.name, []).append(child)
+            owner._index = index
+
+    def __reduce_ex__(self, protocol):
+        # Rebuilding a list subclass appends to it before _owner is set, so
+        # copies are made as plain lists; a copied list has no owner anyway.
+        return (list, (list(self),))
+
+def _notify_owner(method):
+    def _wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._owner._children_changed()
+        return result
+    _wrapper.__name__ = method.__name__
+    return _wrapper
+
+for _method_name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__',
+                     '__iadd__', '__imul__', 'extend', 'insert', 'pop', 'remove',
+                     'reverse', 'sort'):
+    if hasattr(list, _method_name):
+        setattr(_ChildList, _method_name, _notify_owner(getattr(list, _method_name)))
+
+def _new_child_list(owner, children=()):
+    child_list = _ChildList(children)
+    child_list._owner = owner
+    return child_list
+
 def find_nodes(nodes, node_class):
     '''
     Get a list of node_class from a list of KicadPcbNodes.
     node_class is assumed to have a class variable named 'node_type_name'
     that contains the node name to filter for.
     '''
+    return find_all(nodes, [node_class])[node_class]
+
+def find_all(nodes, node_classes):
+    '''
+    Get lists of several node classes from a list of KicadPcbNodes with a
+    single pass over the kicad_pcb root's children. Returns a dict mapping
+    each class in node_classes to its list.
+
+    The wrappers are cached on the root node until its list of children is
+    changed, so repeated calls return the same Module/Segment/Via objects.
+    '''
     kicad_pcb_node = nodes[0]
     if kicad_pcb_node.name != 'kicad_pcb':
         raise Exception('Root node name is not kicad_pcb but is %s!' %
                         kicad_pcb_node.name)
 
-    return [node_class(c) \
-            for c \
-            in kicad_pcb_node.get_children_with_name(node_class.node_type_name)]
+    wrappers = kicad_pcb_node._wrappers
+    if wrappers is None:
+        wrappers = kicad_pcb_node._wrappers = {}
+
+    classes_by_name = {}
+    for node_class in node_classes:
+        if node_class not in wrappers:
+            classes_by_name.setdefault(node_class.node_type_name, []).append(node_class)
+
+    if classes_by_name:
+        buckets = dict((node_class, []) \
+                       for classes in classes_by_name.values() \
+                       for node_class in classes)
+        for child in kicad_pcb_node._children:
+            if isinstance(child, KicadPcbNode) and child.name in classes_by_name:
+                for node_class in classes_by_name[child.name]:
+                    buckets[node_class].append(node_class(child))
+        wrappers.update(buckets)
+
+    # hand out copies so that callers can't modify the cached lists
+    return dict((node_class, list(wrappers[node_class])) for node_class in node_classes)
 
 '''
 ################################################
@@ -142,10 +329,171 @@ def find_nodes(nodes, node_class):
 #
 ################################################
 '''
-def parse_file(kicad_pcb_file_path):
+PARSE_ENGINES = ('tokenizer', 'lazy', 'shlex')
+
+def parse_file(kicad_pcb_file_path, engine='tokenizer', cache=None, workers=None):
     '''
     Parse a kicad_pcb file into a list of KicadPcbNodes.
+
+    cache is an optional nodes.ParseCache.ParseCache. Boards found in it are
+    loaded from there instead of being parsed; other boards are parsed and
+    then stored in it. It can't be combined with the 'lazy' engine.
+
+    workers is the number of processes to parse with; see
+    nodes.ParallelParse. Only the 'tokenizer' engine supports it.
+
+    engine selects the parser implementation:
+        - 'tokenizer' scans the whole file once with nodes.Tokenizer
+        - 'lazy' memory-maps the file and only records where each node's
+          atoms are; they are decoded when the node's children are accessed
+        - 'shlex' is the original line-by-line parser, kept for comparison
+    '''
+    if cache is not None:
+        if engine == 'lazy':
+            raise Exception('The lazy parse engine can not be used with a cache.')
+        nodes = cache.load(kicad_pcb_file_path)
+        if nodes is None:
+            nodes = parse_file(kicad_pcb_file_path, engine, workers=workers)
+            try:
+                cache.store(kicad_pcb_file_path, nodes)
+            except (IOError, OSError) as error:
+                # the cache is only an optimization; the board was parsed
+                _logger.warning('Could not store %s in the parse cache: %s',
+                                kicad_pcb_file_path, error)
+        return nodes
+
+    if workers is not None and workers > 1:
+        if engine != 'tokenizer':
+            raise Exception('Only the tokenizer parse engine can use workers.')
+        # imported here since it imports this module
+        from nodes.ParallelParse import parse_file_parallel
+        return parse_file_parallel(kicad_pcb_file_path, workers)
+
+    if engine == 'tokenizer':
+        return _parse_file_tokenizer(kicad_pcb_file_path)
+    elif engine == 'lazy':
+        return _parse_file_lazy(kicad_pcb_file_path)
+    elif engine == 'shlex':
+        return _parse_file_shlex(kicad_pcb_file_path)
+    else:
+        raise Exception('Unknown parse engine %s. Expected one of %s.' %
+                        (engine, ', '.join(PARSE_ENGINES)))
+
+def _parse_file_tokenizer(kicad_pcb_file_path):
+    with open(kicad_pcb_file_path, 'r') as kicad_pcb_file:
+        text = kicad_pcb_file.read()
+    return _build_nodes(tokenize(text))
+
+def parse_string(text):
+    '''
+    Parse kicad_pcb formatted text, e.g. a module template, into a list of
+    KicadPcbNodes.
+    '''
+    return _build_nodes(tokenize(text))
+
+def _build_nodes(events):
+    '''
+    Build a list of KicadPcbNodes from a stream of tokenizer events.
+    '''
+    nodes = []
+    nodes_in_progress = []
+    for event, value in events:
+        if event == ATOM:
+            if not nodes_in_progress:
+                raise Exception('Value %s is not inside of any node.' % value)
+            _append(nodes_in_progress[-1]._children, _coerce_atom(value))
+        elif event == OPEN:
+            new_node = KicadPcbNode(value)
+            if nodes_in_progress:
+                _append(nodes_in_progress[-1]._children, new_node)
+            nodes_in_progress.append(new_node)
+        else:
+            if not nodes_in_progress:
+                raise Exception('Unbalanced closing paren.')
+            closed_node = nodes_in_progress.pop()
+            if not nodes_in_progress:
+                nodes.append(closed_node)
+
+    if nodes_in_progress:
+        raise Exception('Not all nodes were closed! Remaining nodes: %s' %
+                        ', '.join(node.name for node in nodes_in_progress))
+    return nodes
+
+class _SourceFile(object):
+    '''
+    A memory-mapped kicad_pcb file, shared by all the nodes parsed from it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        # The mapping stays open for as long as any node refers to it.
+        with open(path, 'r') as kicad_pcb_file:
+            self.buffer = mmap.mmap(kicad_pcb_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # the top-level nodes parsed from the file
+        self.roots = []
+        # nodes whose children have been modified since they were parsed
+        self.dirty = set()
+
+def _parse_file_lazy(kicad_pcb_file_path):
+    source = _SourceFile(kicad_pcb_file_path)
+
+    nodes = source.roots
+    nodes_in_progress = []
+    for event, name, start, end in tokenize_spans(source.buffer):
+        if event == ATOM:
+            if not nodes_in_progress:
+                raise Exception('Value at offset %d is not inside of any node.' % start)
+        elif event == OPEN:
+            new_node = KicadPcbNode(name)
+            new_node._source = source
+            new_node._undecoded = True
+            new_node._start = start
+            if nodes_in_progress:
+                _append(nodes_in_progress[-1]._children, new_node)
+            nodes_in_progress.append(new_node)
+        else:
+            if not nodes_in_progress:
+                raise Exception('Unbalanced closing paren at offset %d.' % start)
+            closed_node = nodes_in_progress.pop()
+            closed_node._end = end
+            if not nodes_in_progress:
+                nodes.append(closed_node)
+
+    if nodes_in_progress:
+        raise Exception('Not all nodes were closed! Remaining nodes: %s' %
+                        ', '.join(node.name for node in nodes_in_progress))
+    return list(nodes)
+
+def iter_nodes(kicad_pcb_file_path, names=None):
+    '''
+    Lazily generate the top-level children of the kicad_pcb root node of a
+    kicad_pcb file, each one yielded as soon as it is closed.
+
+    If names is given, only children whose name is in names are built; all
+    other subtrees are skipped over without being tokenized. The file is
+    memory-mapped, so memory use is bounded by the largest yielded child.
     '''
+    with open(kicad_pcb_file_path, 'r') as kicad_pcb_file:
+        buf = mmap.mmap(kicad_pcb_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        event, value, pos = read_token(buf, 0)
+        if event != OPEN or value != 'kicad_pcb':
+            raise Exception('Root node name is not kicad_pcb but is %s!' % value)
+
+        while True:
+            start = pos
+            event, value, pos = read_token(buf, pos)
+            if event == CLOSE:
+                break
+            elif event == OPEN:
+                end = skip_node(buf, start)
+                if names is None or value in names:
+                    yield _build_nodes(tokenize(buf, start, end))[0]
+                pos = end
+    finally:
+        buf.close()
+
+def _parse_file_shlex(kicad_pcb_file_path):
     nodes = []
     nodes_in_progress = []
     with open(kicad_pcb_file_path, 'r') as kicad_pcb_file:
@@ -226,7 +574,9 @@ def _coerce(child):
         return child
     elif hasattr(child, '_node'):
         return child._node
+    return _coerce_atom(child)
 
+def _coerce_atom(child):
     try:
         return int(child)
     except ValueError:
@@ -245,45 +595,197 @@ def _coerce(child):
 #
 ################################################
 '''
+# Size of the output file's buffer, and how many string fragments are
+# collected before they are handed to the file in one write.
+_OUTPUT_BUFFER_SIZE = 1 << 16
+_OUTPUT_CHUNK_FRAGMENTS = 1 << 14
+# Upper bound on the number of distinct formatted floats remembered per write.
+_FLOAT_TEXT_CACHE_SIZE = 1 << 16
+
+# How much of an unchanged source file is copied to the output at a time.
+_COPY_BLOCK_SIZE = 1 << 20
+
 def write_file(file_path, nodes):
     '''
     Write a KicadPcbNode tree to a file.
+
+    Trees parsed by the 'lazy' engine are written incrementally: only the
+    nodes that were changed since parsing are written out again, and all
+    other bytes are copied verbatim from the original file.
+
+    Open TransformSessions that transform objects of this tree are committed
+    first. Sessions of other trees are left open.
     '''
-    with open(file_path, 'w') as output_file:
-        for node in nodes:
-            output_file.write(''.join(_write_node(node)) + '\n')
+    _commit_open_sessions(nodes)
+
+    source = nodes[0]._source if nodes else None
+    if source is not None and source.roots != list(nodes):
+        # top-level nodes were added, removed or reordered
+        source = None
+
+    sources = set(node._source for node in nodes if node._source is not None)
+    if any(_is_same_file(file_path, s.path) for s in sources):
+        # The source is memory-mapped and may still have undecoded nodes, so
+        # it can't be truncated. Write next to it and replace it afterwards.
+        temp_file_path = file_path + '.tmp'
+        _write_file(temp_file_path, nodes, source)
+        os.rename(temp_file_path, file_path)
+    else:
+        _write_file(file_path, nodes, source)
+
+def _commit_open_sessions(nodes):
+    sessions = get_open_sessions()
+    if not sessions:
+        return
+    tree = set()
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        tree.add(id(node))
+        # undecoded nodes hold only their child nodes, so they stay undecoded
+        stack.extend(c for c in node._children if isinstance(c, KicadPcbNode))
+    for session in sessions:
+        if any(id(t._node) in tree for t in session.get_transformables()):
+            session.commit()
+
+def _write_file(file_path, nodes, source):
+    with open(file_path, 'w', _OUTPUT_BUFFER_SIZE) as output_file:
+        if source is not None:
+            _write_changes(output_file, source)
+        else:
+            for node in nodes:
+                _write_node(node, output_file)
+                output_file.write('\n')
 
-# returns a list of string components to be joined
-def _write_node(node, indent_level=0):
-    output = []
+def _is_same_file(file_path, other_file_path):
+    return os.path.exists(file_path) and os.path.samefile(file_path, other_file_path)
+
+def _write_changes(output_file, source):
+    '''
+    Write source to output_file, replacing the text of every changed node
+    with a freshly written copy of it.
+    '''
+    buf = source.buffer
+    pos = 0
+    for node in _get_changed_nodes(source):
+        _copy_source(output_file, buf, pos, node._start)
+        line_start = buf.rfind('\n', 0, node._start) + 1
+        line = buf[line_start:node._start]
+        indent_level = (len(line) - len(line.lstrip(' '))) // OUTPUT_INDENT_SIZE
+        _write_node(node, output_file, indent_level)
+        pos = node._end
+    _copy_source(output_file, buf, pos, len(buf))
+
+def _get_changed_nodes(source):
+    '''
+    Return the outermost dirty nodes of source in file order, leaving out
+    the ones whose values turn out to be equal to what is in the file.
+    '''
+    changed_nodes = []
+    end = 0
+    for node in sorted(source.dirty, key=lambda n: n._start):
+        if node._start < end:
+            # inside of a node that will be written out as a whole
+            continue
+        if _is_unchanged(node):
+            continue
+        changed_nodes.append(node)
+        end = node._end
+    return changed_nodes
+
+def _is_unchanged(node):
+    '''
+    Whether node only has atoms and they are equal to the ones in its source.
+    '''
+    buf = node._source.buffer
+    children = node.children
+    _, _, pos = read_token(buf, node._start)
+    for child in children:
+        event, value, pos = read_token(buf, pos)
+        if event != ATOM or isinstance(child, KicadPcbNode) or \
+           _coerce_atom(value) != child:
+            return False
+    event, _, _ = read_token(buf, pos)
+    return event == CLOSE
+
+def _copy_source(output_file, buf, start, end):
+    while start < end:
+        stop = min(end, start + _COPY_BLOCK_SIZE)
+        output_file.write(buf[start:stop])
+        start = stop
+
+def _write_node(node, output_file, indent_level=0):
+    '''
+    Write node to output_file without recursing, starting at its opening paren.
+    Nested nodes go on their own lines, indented relative to indent_level.
 
-    indent = ' ' * (indent_level * OUTPUT_INDENT_SIZE)
-    # An initial newline is only needed if we are not handling a
-    # root-level node.
-    initial_newline = indent_level != 0
-    output.append('%s%s(%s' % ('\n' if initial_newline else '', \
-                               indent if indent else '', \
-                               node.name))
-
-    def _is_last_child(i):
-        return i == len(node.children) - 1
-
-    for i, child in enumerate(node.children):
-        if isinstance(child, KicadPcbNode):
-            output.extend(_write_node(child, indent_level + 1))
-
-            # If the last child is a node, put my closing paren on
-            # a newline with appropriate indent.
-            if _is_last_child(i):
-                output.append('\n%s)' % indent)
+    Output is collected in chunks and written out whenever a child of node is
+    finished, so memory use doesn't grow with the size of the tree.
+    '''
+    # pylint: disable=unidiomatic-typecheck
+    output = []
+    write = output.append
+    node_type = KicadPcbNode
+    float_texts = {}
+
+    # (children iterator, children) of every unfinished ancestor
+    stack = []
+    children = node.children
+    children_iter = iter(children)
+    write('(' + node.name)
+    while True:
+        for child in children_iter:
+            child_type = type(child)
+            if child_type is node_type:
+                stack.append((children_iter, children))
+                write(_get_indents(indent_level + len(stack))[0] + child.name)
+                children = child.children
+                children_iter = iter(children)
+                break
+            # str/int/float are the only types the parser produces
+            elif child_type is str:
+                write(' ' + child if child else ' ""')
+            elif child_type is float:
+                # Boards repeat the same coordinates and sizes over and over,
+                # and a dict lookup is much cheaper than formatting a float.
+                text = float_texts.get(child)
+                if text is None:
+                    text = ' ' + str(child)
+                    # zero is left out since 0.0 and -0.0 share a key
+                    if child and len(float_texts) < _FLOAT_TEXT_CACHE_SIZE:
+                        float_texts[child] = text
+                write(text)
+            elif child_type is int:
+                write(' ' + str(child))
+            elif child == '':
+                write(' ""')
+            else:
+                write(' ' + str(child))
         else:
-            # If the last child is a string or number, put my closing
-            # paren on the same line.
-            if child == '':
-                str_child = '""'
+            # If the last child is a node, put the closing paren on a new
+            # line with the appropriate indent, otherwise on the same line.
+            if children and type(children[-1]) is node_type:
+                write(_get_indents(indent_level + len(stack))[1])
             else:
-                str_child = str(child)
-            output.append(' %s%s' % (str_child,\
-                                     ')' if _is_last_child(i) else ''))
+                write(')')
+
+            if not stack:
+                break
+            children_iter, children = stack.pop()
+            if not stack and len(output) >= _OUTPUT_CHUNK_FRAGMENTS:
+                output_file.write(''.join(output))
+                del output[:]
+
+    output_file.write(''.join(output))
 
-    return output
+# ('\n<indent>(', '\n<indent>)') for each indent level
+_INDENTS = []
+
+def _get_indents(indent_level):
+    try:
+        return _INDENTS[indent_level]
+    except IndexError:
+        while len(_INDENTS) <= indent_level:
+            indent = ' ' * (len(_INDENTS) * OUTPUT_INDENT_SIZE)
+            _INDENTS.append(('\n' + indent + '(', '\n' + indent + ')'))
+        return _INDENTS[indent_level]
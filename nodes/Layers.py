@@ -0,0 +1,57 @@
+'''
+Functions for working with kicad_pcb layer names.
+'''
+
+# copper layers from top to bottom, as named by KiCAD
+COPPER_LAYERS = ('F.Cu',) + tuple('In%d.Cu' % i for i in range(1, 31)) + ('B.Cu',)
+
+_COPPER_LAYER_INDICES = dict((layer, i) for i, layer in enumerate(COPPER_LAYERS))
+# tuple of layer names -> frozenset of copper layers, for both functions below
+_copper_layer_sets = {}
+_via_layer_sets = {}
+
+def _strip_quotes(layer):
+    return layer[1:-1] if len(layer) > 1 and layer[0] == '"' == layer[-1] else layer
+
+def _as_tuple(layers):
+    if isinstance(layers, str):
+        return (layers,)
+    return tuple(layers)
+
+def get_copper_layers(layers):
+    '''
+    Return the frozenset of copper layers among layers, which is a layer
+    name or a list of them. Wildcards such as '*.Cu' and 'F&B.Cu' are
+    expanded, and layers that aren't copper are left out.
+    '''
+    layers = _as_tuple(layers)
+    copper_layers = _copper_layer_sets.get(layers)
+    if copper_layers is None:
+        found = set()
+        for layer in layers:
+            layer = _strip_quotes(str(layer))
+            if layer == '*.Cu':
+                found.update(COPPER_LAYERS)
+            elif layer == 'F&B.Cu':
+                found.update(('F.Cu', 'B.Cu'))
+            elif layer in _COPPER_LAYER_INDICES:
+                found.add(layer)
+        copper_layers = _copper_layer_sets[layers] = frozenset(found)
+    return copper_layers
+
+def get_via_copper_layers(layers):
+    '''
+    Return the frozenset of copper layers a via connects. A via lists the
+    two copper layers it goes between, and connects every layer from one to
+    the other, so that through, blind and buried vias are all handled.
+    '''
+    layers = _as_tuple(layers)
+    copper_layers = _via_layer_sets.get(layers)
+    if copper_layers is None:
+        indices = [_COPPER_LAYER_INDICES[layer] for layer in get_copper_layers(layers)]
+        if indices:
+            copper_layers = frozenset(COPPER_LAYERS[min(indices):max(indices) + 1])
+        else:
+            copper_layers = frozenset()
+        _via_layer_sets[layers] = copper_layers
+    return copper_layers
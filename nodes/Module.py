@@ -1,10 +1,15 @@
 '''
 Classes and functions related to kicad_pcb module nodes.
 '''
+import math
+import re
+import sre_constants
+import sre_parse
+from bisect import bisect_left
 from KicadPcbNode import KicadPcbNode
 from KicadPcbNode import find_nodes
-from numpy import array
-from Transform2d import Transformable, get_rotation_matrix, get_translation_matrix, transform_point
+from numpy import array, around, empty
+from Transform2d import Transformable, RigidTransform, get_transform_matrix
 
 def find_modules(nodes):
     ''' Get a list of Modules from a list of KicadPcbNodes. '''
@@ -32,31 +37,65 @@ class Module(Transformable):
         '''
         # pylint: disable=invalid-name
         self._node = node
-        self._init_name()
-        self.x, self.y, self.r = _get_position_and_rotation(node)
-        self._pads = self._node.get_children_with_name('pad')
-
-    def _init_name(self):
-        # look for node with name 'fp_text' whose first child is 'reference'
-        # use the second child of this node as our name
-        for child in self._node.get_children_with_name('fp_text'):
-            fp_text_children = child.children
-            if fp_text_children[0] == 'reference':
-                self.name = fp_text_children[1]
-                break
-            else:
+        at_node = self._init_children()
+        self.x, self.y, self.r = _get_position_and_rotation(node, at_node)
+        # (n, 2) array of the pads' positions relative to the module
+        self._pad_offsets = None
+        # ((x, y, r), pad positions) as of the last get_pad_positions call
+        self._pad_positions = None
+
+    def _init_children(self):
+        '''
+        Find the name and pads of the module in one pass over its children,
+        which is cheaper than having the node build its index of children by
+        name. Returns the 'at' node, or None if there isn't exactly one.
+        '''
+        self.name = None
+        self._pads = []
+        at_nodes = []
+        for child in self._node._children:
+            if not isinstance(child, KicadPcbNode):
                 continue
+            name = child.name
+            if name == 'pad':
+                self._pads.append(child)
+            elif name == 'at':
+                at_nodes.append(child)
+            elif name == 'fp_text' and self.name is None:
+                # the fp_text whose first child is 'reference' has our name
+                # as its second child
+                fp_text_children = child.children
+                if fp_text_children[0] == 'reference':
+                    self.name = fp_text_children[1]
 
         if not self.name:
             raise Exception("Couldn't find a name!")
+        return at_nodes[0] if len(at_nodes) == 1 else None
+
+    def get_footprint(self):
+        ''' Return the name of the module's footprint, e.g. 'Keyswitch:MX'. '''
+        return self._node.children[0]
+
+    def get_layer(self):
+        ''' Return the layer the module is on, or None if it has none. '''
+        layer_nodes = self._node.get_children_with_name('layer')
+        return layer_nodes[0].children[0] if layer_nodes else None
 
     def transform(self, t=(0, 0), r=0, rp=(0, 0)):
-        T = get_translation_matrix(t=t)
-        R = get_rotation_matrix(r=r, rp=rp)
-        transform = T.dot(R)
+        transform = get_transform_matrix(t=t, r=r, rp=rp)
 
         position = array([self.x, self.y, 1])
-        self.x, self.y, _ = transform.dot(position).round(5)
+        self.x, self.y, _ = transform.dot(position).round(5) + 0.0
+        self._update_position()
+
+        self.r += r
+        self._update_rotation()
+
+    def get_transform_points(self):
+        return [array([self.x, self.y, 1])]
+
+    def set_transform_points(self, points, r):
+        self.x, self.y, _ = points[0]
         self._update_position()
 
         self.r += r
@@ -73,6 +112,9 @@ class Module(Transformable):
         dr = self.r - old_rotation
 
         _get_at_node(self._node).children = [self.x, self.y, self.r]
+        if dr == 0:
+            # leave the children alone so they are not needlessly rewritten
+            return
         for child in self._node.children:
             child_at_node = _get_at_node(child)
             if child_at_node is not None:
@@ -85,9 +127,61 @@ class Module(Transformable):
         return (self.x, self.y)
 
     def get_pad_positions(self):
-        return [transform_point(self.x + pad_x, self.y + pad_y, r=self.r, rp=(self.x, self.y)) \
-                for pad_x, pad_y, _ \
-                in map(_get_position_and_rotation, self._pads)]
+        '''
+        Return a list of the (x, y) positions of this module's pads on the
+        board. The result is cached until the module's position or rotation
+        changes.
+        '''
+        key = (self.x, self.y, self.r)
+        if self._pad_positions is None or self._pad_positions[0] != key:
+            self._pad_positions = (key, self._compute_pad_positions())
+        return list(self._pad_positions[1])
+
+    def _compute_pad_positions(self):
+        if self._pad_offsets is None:
+            self._pad_offsets = empty((len(self._pads), 2))
+            for i, pad in enumerate(self._pads):
+                self._pad_offsets[i] = _get_position_and_rotation(pad)[:2]
+
+        # rotate all of the pads about the module's position at once; every
+        # module has its own pivot, so this doesn't go through the transform
+        # cache, which is for the transforms scripts apply to many objects
+        rotation = RigidTransform.from_params(r=self.r, rp=(self.x, self.y))
+        pad_x = self._pad_offsets[:, 0] + self.x
+        pad_y = self._pad_offsets[:, 1] + self.y
+        board_x = around(rotation.cos * pad_x - rotation.sin * pad_y + rotation.tx, 5)
+        board_y = around(rotation.sin * pad_x + rotation.cos * pad_y + rotation.ty, 5)
+        return zip(board_x.tolist(), board_y.tolist())
+
+    def get_bounding_box(self):
+        '''
+        Return (min x, min y, max x, max y) of this module's pads. Every pad
+        is taken to be a circle around its position that is as wide as the
+        pad's diagonal, so that the box holds the pads at any rotation.
+        '''
+        pad_positions = self.get_pad_positions()
+        if not pad_positions:
+            return (self.x, self.y, self.x, self.y)
+        boxes = []
+        for (x, y), pad in zip(pad_positions, self._pads):
+            radius = _get_pad_radius(pad)
+            boxes.append((x - radius, y - radius, x + radius, y + radius))
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+    def get_pad_layers(self):
+        '''
+        Return a list of the layer names of each pad, in the same order as
+        get_pad_positions.
+        '''
+        return [_get_pad_layers(pad) for pad in self._pads]
+
+    def get_pad_nets(self):
+        '''
+        Return a list of the net numbers of the pads, in the same order as
+        get_pad_positions, with None for pads that aren't connected.
+        '''
+        return [_get_pad_net(pad) for pad in self._pads]
 
     def __str__(self):
         return "Module[%s, (%f, %f), %d]" % (self.name, self.x, self.y, self.r)
@@ -95,10 +189,148 @@ class Module(Transformable):
     def __repr__(self):
         return self.__str__()
 
+class ModuleIndex(object):
+    '''
+    The modules of a board indexed by reference, so that selecting modules
+    by name, prefix or regex doesn't go through every module.
+
+    The references are kept sorted, so a prefix query is a bisect followed
+    by a scan of the matching range. A regex query narrows the range down
+    the same way to the literal prefixes every match has to start with,
+    e.g. 'S' for 'S([0-9]+):([0-9]+)' and 'D' and 'S' for '[DS]([0-9]+)'.
+
+    The indexes by footprint, layer and net are built when they are first
+    used. Every query returns modules in the order they were given in.
+    '''
+    def __init__(self, modules):
+        self.modules = list(modules)
+        # name -> list of module indices
+        self._by_name = {}
+        for i, module in enumerate(self.modules):
+            self._by_name.setdefault(module.name, []).append(i)
+        self._names = sorted(self._by_name)
+        self._by_footprint = None
+        self._by_layer = None
+        self._by_net = None
+
+    def __len__(self):
+        return len(self.modules)
+
+    def get(self, name, default=None):
+        '''
+        Return the module with reference name, or default if there is none.
+        '''
+        indices = self._by_name.get(name)
+        return self.modules[indices[0]] if indices else default
+
+    def get_modules(self, *names):
+        ''' Return the modules whose reference is one of names. '''
+        return self._get_modules(i for name in set(names) for i in self._by_name.get(name, ()))
+
+    def with_prefix(self, prefix):
+        ''' Return the modules whose reference starts with prefix. '''
+        return self._get_modules(i for name in self._get_names_with_prefix(prefix)
+                                 for i in self._by_name[name])
+
+    def matching(self, pattern):
+        '''
+        Return the modules whose reference matches pattern, a regex or a
+        compiled regex, from the start as re.match does.
+        '''
+        pattern = re.compile(pattern) if isinstance(pattern, basestring) else pattern
+        names = set()
+        for prefix in _get_literal_prefixes(pattern):
+            names.update(name for name in self._get_names_with_prefix(prefix) \
+                         if pattern.match(name))
+        return self._get_modules(i for name in names for i in self._by_name[name])
+
+    def with_footprint(self, footprint):
+        ''' Return the modules with footprint, e.g. 'Keyswitch:MX'. '''
+        if self._by_footprint is None:
+            self._by_footprint = self._build_index(lambda module: [module.get_footprint()])
+        return self._get_modules(self._by_footprint.get(footprint, ()))
+
+    def on_layer(self, layer):
+        ''' Return the modules on layer, e.g. 'F.Cu'. '''
+        if self._by_layer is None:
+            self._by_layer = self._build_index(lambda module: [module.get_layer()])
+        return self._get_modules(self._by_layer.get(layer, ()))
+
+    def on_net(self, net):
+        ''' Return the modules with a pad on the net with number net. '''
+        if self._by_net is None:
+            self._by_net = self._build_index(lambda module: set(module.get_pad_nets()))
+        return self._get_modules(self._by_net.get(net, ()))
+
+    def _build_index(self, get_keys):
+        index = {}
+        for i, module in enumerate(self.modules):
+            for key in get_keys(module):
+                index.setdefault(key, []).append(i)
+        return index
+
+    def _get_names_with_prefix(self, prefix):
+        names = self._names
+        start = bisect_left(names, prefix)
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+    def _get_modules(self, indices):
+        modules = self.modules
+        return [modules[i] for i in sorted(set(indices))]
+
+# Character classes with up to this many characters are expanded into that
+# many prefixes by _get_literal_prefixes.
+_MAX_CLASS_PREFIXES = 32
+
+def _get_literal_prefixes(pattern):
+    '''
+    Return prefixes such that every string pattern matches starts with one
+    of them: the literal characters the regex starts with, branching on a
+    leading character class. Returns [''] if nothing better is known.
+    '''
+    if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ['']
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except sre_constants.error:
+        return ['']
+
+    prefixes = ['']
+    for op, value in parsed:
+        if op == sre_constants.LITERAL:
+            prefixes = [prefix + unichr(value) for prefix in prefixes]
+        elif op == sre_constants.IN:
+            characters = _get_class_characters(value)
+            if characters is None or len(prefixes) * len(characters) > _MAX_CLASS_PREFIXES:
+                break
+            prefixes = [prefix + c for prefix in prefixes for c in characters]
+        else:
+            break
+    # references are byte strings, which can only be compared to unicode
+    # prefixes by decoding them, so use byte strings where possible
+    return [str(prefix) if all(ord(c) < 128 for c in prefix) else prefix \
+            for prefix in prefixes]
+
+def _get_class_characters(items):
+    characters = []
+    for op, value in items:
+        if op == sre_constants.LITERAL:
+            characters.append(unichr(value))
+        elif op == sre_constants.RANGE and value[1] - value[0] < _MAX_CLASS_PREFIXES:
+            characters.extend(unichr(c) for c in range(value[0], value[1] + 1))
+        else:
+            # negated classes, categories such as \d, ...
+            return None
+    return characters
+
 # Looks for a child of the specified node named 'at' and extracts position
 # and rotation information from it.
-def _get_position_and_rotation(node):
-    at_node = _get_at_node(node)
+def _get_position_and_rotation(node, at_node=None):
+    if at_node is None:
+        at_node = _get_at_node(node)
     at_children = at_node.children
 
     # pylint: disable=invalid-name
@@ -106,6 +338,21 @@ def _get_position_and_rotation(node):
     r = int(at_children[2]) if len(at_children) == 3 else 0
     return (x, y, r)
 
+def _get_pad_radius(pad):
+    size_nodes = pad.get_children_with_name('size')
+    if not size_nodes:
+        return 0.0
+    size = [float(dimension) for dimension in size_nodes[0].children[:2]]
+    return math.hypot(*size) / 2.0 if len(size) == 2 else size[0] / 2.0
+
+def _get_pad_layers(pad):
+    layers_nodes = pad.get_children_with_name('layers')
+    return list(layers_nodes[0].children) if layers_nodes else []
+
+def _get_pad_net(pad):
+    net_nodes = pad.get_children_with_name('net')
+    return net_nodes[0].children[0] if net_nodes else None
+
 def _get_at_node(node):
     if not isinstance(node, KicadPcbNode):
         return None
@@ -0,0 +1,103 @@
+'''
+Parse large kicad_pcb files with a pool of worker processes.
+
+The file is scanned once for the paren depth to find where the children of
+the top-level nodes (modules, segments, vias, ...) begin and end. Runs of
+children are handed to the workers, which parse them and send the nodes
+back in the compact format of nodes.ParseCache. The top-level nodes
+themselves are parsed here, and the children are put back into them in the
+order they appear in the file, so the tree is the same as a serial parse.
+
+Usage:
+    nodes = parse_file(path, workers=4)
+'''
+import multiprocessing
+from nodes.Tokenizer import tokenize, find_child_spans, OPEN, ATOM
+from nodes.KicadPcbNode import KicadPcbNode, parse_string, _append, _coerce_atom
+from nodes.ParseCache import encode_tree, decode_tree
+
+# Every worker gets about this many chunks, so that a slow chunk doesn't
+# leave the other workers idle at the end.
+CHUNKS_PER_WORKER = 4
+
+def parse_file_parallel(kicad_pcb_file_path, workers):
+    '''
+    Parse a kicad_pcb file into a list of KicadPcbNodes using workers
+    processes.
+    '''
+    with open(kicad_pcb_file_path, 'r') as kicad_pcb_file:
+        text = kicad_pcb_file.read()
+
+    spans = find_child_spans(text)
+    chunks = _get_chunks(text, spans, workers * CHUNKS_PER_WORKER)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        encoded_chunks = pool.imap(_parse_chunk, [text[start:end] for start, end in chunks])
+        children = (child for encoded_chunk in encoded_chunks \
+                    for child in decode_tree(encoded_chunk))
+        nodes = _build_top_level_nodes(text, spans, children)
+    finally:
+        pool.terminate()
+        pool.join()
+    return nodes
+
+def _parse_chunk(text):
+    return encode_tree(parse_string(text))
+
+def _get_chunks(text, spans, chunk_count):
+    '''
+    Group the child spans into about chunk_count runs of similar size. A
+    run only holds children with nothing but whitespace between them.
+    '''
+    if not spans:
+        return []
+    target_size = max((spans[-1][1] - spans[0][0]) // chunk_count, 1)
+
+    chunks = []
+    chunk_start, chunk_end = spans[0]
+    for start, end in spans[1:]:
+        if end - chunk_start > target_size or text[chunk_end:start].strip():
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = start
+        chunk_end = end
+    chunks.append((chunk_start, chunk_end))
+    return chunks
+
+def _build_top_level_nodes(text, spans, children):
+    '''
+    Parse the text outside of spans into KicadPcbNodes, putting the nodes
+    from children in place of the spans.
+    '''
+    nodes = []
+    nodes_in_progress = []
+
+    def _build(start, end):
+        for event, value in tokenize(text, start, end):
+            if event == ATOM:
+                if not nodes_in_progress:
+                    raise Exception('Value %s is not inside of any node.' % value)
+                _append(nodes_in_progress[-1]._children, _coerce_atom(value))
+            elif event == OPEN:
+                new_node = KicadPcbNode(value)
+                if nodes_in_progress:
+                    _append(nodes_in_progress[-1]._children, new_node)
+                nodes_in_progress.append(new_node)
+            else:
+                if not nodes_in_progress:
+                    raise Exception('Unbalanced closing paren.')
+                closed_node = nodes_in_progress.pop()
+                if not nodes_in_progress:
+                    nodes.append(closed_node)
+
+    pos = 0
+    for start, end in spans:
+        _build(pos, start)
+        _append(nodes_in_progress[-1]._children, next(children))
+        pos = end
+    _build(pos, len(text))
+
+    if nodes_in_progress:
+        raise Exception('Not all nodes were closed! Remaining nodes: %s' %
+                        ', '.join(node.name for node in nodes_in_progress))
+    return nodes
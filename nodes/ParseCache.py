@@ -0,0 +1,277 @@
+'''
+An on-disk cache of parsed kicad_pcb files.
+
+Parsed trees are stored in a compact binary format rather than pickled: the
+tree is flattened into a sequence of opcodes plus typed arrays of names,
+strings, ints and floats, which can be turned back into KicadPcbNodes much
+faster than the text can be parsed.
+
+Usage:
+    nodes = parse_file(path, cache=ParseCache())
+'''
+import hashlib
+import logging
+import os
+import struct
+from array import array
+from nodes.KicadPcbNode import KicadPcbNode
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'kicad_utils')
+DEFAULT_MAX_BYTES = 1 << 30
+
+_ENTRY_EXTENSION = '.kpc'
+_MAGIC = 'KPCBTREE'
+_VERSION = 1
+# magic, version, sizes of the array item types, sha1 of the board, board size
+_HEADER = struct.Struct('<8sIBBB20sQ')
+_SECTION_LENGTH = struct.Struct('<Q')
+_HASH_BLOCK_SIZE = 1 << 20
+
+_append = list.append
+
+_logger = logging.getLogger(__name__)
+
+_OP_OPEN = 0
+_OP_CLOSE = 1
+_OP_STR = 2
+_OP_INT = 3
+_OP_FLOAT = 4
+# ints too big for the int array are stored as strings
+_OP_BIG_INT = 5
+
+class ParseCache(object):
+    '''
+    A directory of parsed boards, keyed by the board's path, modification
+    time and size, and checked against the sha1 of its contents when loaded.
+    Once the directory holds more than max_bytes, the least recently used
+    entries are removed.
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+
+    def load(self, kicad_pcb_file_path):
+        '''
+        Return the cached list of KicadPcbNodes for a kicad_pcb file, or None
+        if there is no valid entry for it.
+        '''
+        entry_path = self._get_entry_path(kicad_pcb_file_path)
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                data = entry_file.read()
+            nodes = _decode(data, _hash_file(kicad_pcb_file_path))
+        except Exception: # pylint: disable=broad-except
+            # corrupt, truncated or stale; it will be replaced on the next store
+            _remove(entry_path)
+            return None
+
+        # bump the modification time, which is what eviction goes by
+        try:
+            os.utime(entry_path, None)
+        except OSError as error:
+            _logger.warning('Could not touch parse cache entry %s: %s', entry_path, error)
+        return nodes
+
+    def store(self, kicad_pcb_file_path, nodes):
+        '''
+        Store the parsed KicadPcbNodes of a kicad_pcb file.
+        '''
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        data = _encode(nodes, _hash_file(kicad_pcb_file_path))
+        entry_path = self._get_entry_path(kicad_pcb_file_path)
+        temp_entry_path = '%s.%d.tmp' % (entry_path, os.getpid())
+        try:
+            with open(temp_entry_path, 'wb') as entry_file:
+                entry_file.write(data)
+            os.rename(temp_entry_path, entry_path)
+        except:
+            _remove(temp_entry_path)
+            raise
+
+        self._evict()
+
+    def _get_entry_path(self, kicad_pcb_file_path):
+        kicad_pcb_file_path = os.path.abspath(kicad_pcb_file_path)
+        stat = os.stat(kicad_pcb_file_path)
+        key = '%s\0%r\0%d' % (kicad_pcb_file_path, stat.st_mtime, stat.st_size)
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key).hexdigest() + _ENTRY_EXTENSION)
+
+    def _evict(self):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(_ENTRY_EXTENSION):
+                entry_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            _remove(entry_path)
+            total_bytes -= size
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _hash_file(file_path):
+    sha1 = hashlib.sha1()
+    size = 0
+    with open(file_path, 'rb') as input_file:
+        while True:
+            block = input_file.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha1.update(block)
+            size += len(block)
+    return (sha1.digest(), size)
+
+def _encode(nodes, file_hash):
+    digest, size = file_hash
+    return _HEADER.pack(_MAGIC, _VERSION, array('I').itemsize, array('i').itemsize,
+                        array('d').itemsize, digest, size) + encode_tree(nodes)
+
+def encode_tree(nodes):
+    '''
+    Flatten a list of KicadPcbNodes into a string, which decode_tree turns
+    back into the same nodes. This is the body of a cache entry.
+    '''
+    # pylint: disable=unidiomatic-typecheck
+    ops = array('B')
+    string_ids = array('I')
+    ints = array('i')
+    floats = array('d')
+    strings = {}
+
+    def _add_string(string):
+        string_id = strings.get(string)
+        if string_id is None:
+            string_id = strings[string] = len(strings)
+        string_ids.append(string_id)
+
+    # The tree is written in the order it appears in the file: every node is
+    # an _OP_OPEN with its name, then its children, then an _OP_CLOSE.
+    for node in nodes:
+        ops.append(_OP_OPEN)
+        _add_string(node.name)
+        stack = [iter(node.children)]
+        while stack:
+            for child in stack[-1]:
+                child_type = type(child)
+                if child_type is KicadPcbNode:
+                    ops.append(_OP_OPEN)
+                    _add_string(child.name)
+                    stack.append(iter(child.children))
+                    break
+                elif child_type is str:
+                    ops.append(_OP_STR)
+                    _add_string(child)
+                elif child_type is float:
+                    ops.append(_OP_FLOAT)
+                    floats.append(child)
+                else:
+                    try:
+                        ints.append(child)
+                        ops.append(_OP_INT)
+                    except OverflowError:
+                        ops.append(_OP_BIG_INT)
+                        _add_string(str(child))
+            else:
+                ops.append(_OP_CLOSE)
+                stack.pop()
+
+    string_list = [None] * len(strings)
+    for string, string_id in strings.items():
+        string_list[string_id] = string
+    string_lengths = array('I', [len(string) for string in string_list])
+
+    sections = [string_lengths.tostring(), ''.join(string_list), ops.tostring(),
+                string_ids.tostring(), ints.tostring(), floats.tostring()]
+    return ''.join(_SECTION_LENGTH.pack(len(section)) + section for section in sections)
+
+def _decode(data, file_hash):
+    magic, version, id_size, int_size, float_size, digest, size = \
+        _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION or \
+       (id_size, int_size, float_size) != (array('I').itemsize, array('i').itemsize,
+                                           array('d').itemsize):
+        raise Exception('Unsupported cache entry format.')
+    if (digest, size) != file_hash:
+        raise Exception('Cache entry is for different file contents.')
+    return decode_tree(data, _HEADER.size)
+
+def decode_tree(data, pos=0):
+    '''
+    Turn data[pos:], as returned by encode_tree, back into a list of
+    KicadPcbNodes.
+    '''
+    # pylint: disable=protected-access
+    sections = []
+    for _ in range(6):
+        length, = _SECTION_LENGTH.unpack_from(data, pos)
+        pos += _SECTION_LENGTH.size
+        sections.append(data[pos:pos + length])
+        pos += length
+    if pos != len(data):
+        raise Exception('Cache entry has trailing data.')
+
+    string_lengths, string_blob, ops, string_ids, ints, floats = \
+        [array(typecode, section).tolist() if typecode else section \
+         for typecode, section in zip(('I', None, 'B', 'I', 'i', 'd'), sections)]
+
+    strings = []
+    string_pos = 0
+    for length in string_lengths:
+        strings.append(string_blob[string_pos:string_pos + length])
+        string_pos += length
+
+    # values are consumed front to back; popping from reversed lists is cheap
+    for values in (string_ids, ints, floats):
+        values.reverse()
+    next_string_id = string_ids.pop
+    next_int = ints.pop
+    next_float = floats.pop
+
+    nodes = []
+    nodes_in_progress = []
+    # children of the innermost node in progress
+    children = None
+    for op in ops:
+        if op == _OP_INT:
+            _append(children, next_int())
+        elif op == _OP_STR:
+            _append(children, strings[next_string_id()])
+        elif op == _OP_FLOAT:
+            _append(children, next_float())
+        elif op == _OP_OPEN:
+            new_node = KicadPcbNode(strings[next_string_id()])
+            if nodes_in_progress:
+                _append(children, new_node)
+            nodes_in_progress.append(new_node)
+            children = new_node._children
+        elif op == _OP_CLOSE:
+            closed_node = nodes_in_progress.pop()
+            if nodes_in_progress:
+                children = nodes_in_progress[-1]._children
+            else:
+                nodes.append(closed_node)
+        elif op == _OP_BIG_INT:
+            _append(children, int(strings[next_string_id()]))
+        else:
+            raise Exception('Unknown opcode %d.' % op)
+
+    if nodes_in_progress or string_ids or ints or floats:
+        raise Exception('Cache entry is inconsistent.')
+    return nodes
@@ -4,7 +4,7 @@ Classes and functions related to kicad_pcb segment nodes.
 import math
 from nodes.KicadPcbNode import find_nodes, KicadPcbNode
 from numpy import array
-from nodes.Transform2d import Transformable, get_rotation_matrix, get_translation_matrix
+from nodes.Transform2d import Transformable, get_transform_matrix
 
 def find_segments(nodes):
     ''' Get a list of Segments from a list of KicadPcbNodes. '''
@@ -47,12 +47,18 @@ class Segment(Transformable):
         return cls(node)
 
     def transform(self, t=(0, 0), r=0, rp=(0, 0)):
-        T = get_translation_matrix(t=t)
-        R = get_rotation_matrix(r=r, rp=rp)
-        transform = T.dot(R)
+        transform = get_transform_matrix(t=t, r=r, rp=rp)
 
-        self.start = transform.dot(self.start).round(5)
-        self.end = transform.dot(self.end).round(5)
+        # + 0.0 writes 0 instead of -0, as transform_with_matrix does
+        self.start = transform.dot(self.start).round(5) + 0.0
+        self.end = transform.dot(self.end).round(5) + 0.0
+        self._update_node()
+
+    def get_transform_points(self):
+        return [self.start, self.end]
+
+    def set_transform_points(self, points, r):
+        self.start, self.end = points
         self._update_node()
 
     def _update_node(self):
@@ -70,6 +76,15 @@ class Segment(Transformable):
         '''Return the end position of this segment.'''
         return tuple(self.end[:2])
 
+    def get_bounding_box(self):
+        '''Return (min x, min y, max x, max y) of this segment, including
+        its width.'''
+        half_width = self.width / 2.0
+        return (min(self.start[0], self.end[0]) - half_width,
+                min(self.start[1], self.end[1]) - half_width,
+                max(self.start[0], self.end[0]) + half_width,
+                max(self.start[1], self.end[1]) + half_width)
+
     def get_other_end(self, position):
         '''If position is one end of this segment, return the
         position of the other end. If not, raise.'''
@@ -0,0 +1,130 @@
+'''
+Single-pass tokenizer for the s-expressions used in .kicad_pcb files.
+
+The whole buffer is scanned once and turned into a stream of events:
+    (OPEN, name)  -- an opening paren followed by the node's name
+    (ATOM, text)  -- a bare or quoted value
+    (CLOSE, None) -- a closing paren
+
+Quoted strings keep their quotes (as the shlex based parser did) and may
+contain whitespace, parens, newlines and backslash-escaped quotes.
+'''
+import re
+
+OPEN = 0
+ATOM = 1
+CLOSE = 2
+
+_CLOSE_EVENT = (CLOSE, None)
+
+# An atom is a run of characters that are neither whitespace nor parens.
+# Quoted sections may appear anywhere in an atom and may contain anything.
+_ATOM = r'(?:[^\s()"]|"(?:[^"\\]|\\.)*")+'
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<open>\(\s*(?P<name>%s)?)
+      | (?P<close>\))
+      | (?P<atom>%s)
+      | (?P<error>\S)
+    )''' % (_ATOM, _ATOM), re.VERBOSE | re.DOTALL)
+
+# Only parens and quoted strings matter when skipping over a node; everything
+# else is jumped over by the regex engine.
+_PAREN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[()]', re.DOTALL)
+
+def tokenize(text, pos=0, endpos=None):
+    '''
+    Generate (event, value) tuples for the s-expression in text[pos:endpos].
+    '''
+    if endpos is None:
+        endpos = len(text)
+    for match in _TOKEN_RE.finditer(text, pos, endpos):
+        # atoms and closing parens make up most of a board; handle them inline
+        group = match.lastgroup
+        if group == 'atom':
+            yield (ATOM, match.group('atom'))
+        elif group == 'close':
+            yield _CLOSE_EVENT
+        else:
+            yield _to_event(match)
+
+def tokenize_spans(text, pos=0, endpos=None):
+    '''
+    Like tokenize, but generate (event, name, start, end) tuples where start
+    and end delimit the token in text. Atom text is never copied out of text;
+    name is only set for OPEN events.
+    '''
+    if endpos is None:
+        endpos = len(text)
+    for match in _TOKEN_RE.finditer(text, pos, endpos):
+        group = match.lastgroup
+        if group == 'atom':
+            yield (ATOM, None, match.start('atom'), match.end())
+        elif group == 'close':
+            yield (CLOSE, None, match.start('close'), match.end())
+        else:
+            event, name = _to_event(match)
+            yield (event, name, match.start('open'), match.end())
+
+def read_token(text, pos):
+    '''
+    Read the single token starting at (or after whitespace following) pos.
+    Returns (event, value, end), where end is the offset just past the token.
+    '''
+    match = _TOKEN_RE.match(text, pos)
+    if match is None:
+        raise Exception('Unexpected end of input at offset %d.' % pos)
+    event, value = _to_event(match)
+    return (event, value, match.end())
+
+def skip_node(text, pos):
+    '''
+    Return the offset just past the closing paren of the node whose opening
+    paren is the first one at or after pos, without tokenizing its contents.
+    '''
+    depth = 0
+    for match in _PAREN_RE.finditer(text, pos):
+        token = match.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise Exception('Node at offset %d is never closed.' % pos)
+
+def find_child_spans(text):
+    '''
+    Return a list of (start, end) offsets of the children of the top-level
+    nodes in text, found by counting parens without tokenizing anything else.
+    '''
+    spans = []
+    depth = 0
+    start = None
+    for match in _PAREN_RE.finditer(text):
+        token = match.group()
+        if token == '(':
+            depth += 1
+            if depth == 2:
+                start = match.start()
+        elif token == ')':
+            if depth == 2:
+                spans.append((start, match.end()))
+            depth -= 1
+    return spans
+
+def _to_event(match):
+    group = match.lastgroup
+    if group == 'atom':
+        return (ATOM, match.group('atom'))
+    elif group == 'close':
+        return _CLOSE_EVENT
+    elif group == 'open':
+        name = match.group('name')
+        if name is None:
+            raise Exception('Node without a name at offset %d.' % match.start('open'))
+        return (OPEN, name)
+    else:
+        raise Exception('Unexpected character %r at offset %d.' %
+                        (match.group('error'), match.start('error')))
@@ -3,53 +3,122 @@ Functions for transforming 2D points.
 '''
 from math import radians, sin, cos
 from abc import ABCMeta, abstractmethod
-from numpy import array, identity
-from numpy.linalg import inv
+from collections import OrderedDict
+from numpy import array, around, identity
 
 # pylint: disable=invalid-name, bad-whitespace, unused-variable
 
-def rotate_about_pivot(px, py, rotation, rpx, rpy):
+# number of (t, r, rp) combinations whose transforms are kept around
+TRANSFORM_CACHE_SIZE = 256
+
+class RigidTransform(object):
     '''
-    Rotate a point (px, py) about the point (rpx, rpy) by rotation degrees.
+    A rotation followed by a translation, stored in closed form as the cosine
+    and sine of the rotation and the translation (tx, ty). Composing,
+    inverting and applying these doesn't need any matrices.
     '''
-    rotate_pivot_matrix = identity(3)
-    rotate_pivot_matrix[:2, 2] = array([rpx, rpy])
+    __slots__ = ('cos', 'sin', 'tx', 'ty')
 
-    r = radians(rotation)
+    def __init__(self, cos=1.0, sin=0.0, tx=0.0, ty=0.0):
+        self.cos = cos
+        self.sin = sin
+        self.tx = tx
+        self.ty = ty
 
-    s = sin(r)
-    c = cos(r)
-    rotation = array([[c, -s, 0],
-                      [s,  c, 0],
-                      [0,  0, 1]])
+    @classmethod
+    def from_params(cls, t=(0, 0), r=0, rp=(0, 0)):
+        '''
+        Get the transform that rotates by r degrees about the pivot point rp
+        and then translates by t, the same as transform() does.
+        '''
+        # r is negated because of KiCAD's rotation direction
+        r = -radians(r)
+        c = cos(r)
+        s = sin(r)
+        rpx, rpy = rp
+        return cls(c, s,
+                   rpx - c * rpx + s * rpy + t[0],
+                   rpy - s * rpx - c * rpy + t[1])
 
-    x, y, w = rotate_pivot_matrix.dot(rotation)                 \
-                                 .dot(inv(rotate_pivot_matrix)) \
-                                 .dot(array([px, py, 1]))       \
-                                 .round(5)
-    return (x, y)
+    def compose(self, other):
+        '''
+        Get the transform that applies other first and then this transform.
+        '''
+        c = self.cos
+        s = self.sin
+        return RigidTransform(c * other.cos - s * other.sin,
+                              s * other.cos + c * other.sin,
+                              c * other.tx - s * other.ty + self.tx,
+                              s * other.tx + c * other.ty + self.ty)
 
-def get_rotation_matrix(r = 0, rp = (0, 0)):
+    def inverse(self):
+        ''' Get the transform that undoes this transform. '''
+        c = self.cos
+        s = self.sin
+        return RigidTransform(c, -s,
+                              -c * self.tx - s * self.ty,
+                              s * self.tx - c * self.ty)
+
+    def apply(self, x, y):
+        ''' Transform the point (x, y). '''
+        return (self.cos * x - self.sin * y + self.tx,
+                self.sin * x + self.cos * y + self.ty)
+
+    def get_matrix(self):
+        ''' Get the 3x3 transformation matrix for this transform. '''
+        return array([[self.cos, -self.sin, self.tx],
+                      [self.sin,  self.cos, self.ty],
+                      [0.0,       0.0,      1.0]])
+
+    def __repr__(self):
+        return 'RigidTransform(%r, %r, %r, %r)' % (self.cos, self.sin, self.tx, self.ty)
+
+# (t, r, rp) -> (RigidTransform, read-only matrix), least recently used first
+_transform_cache = OrderedDict()
+
+def get_transform(t=(0, 0), r=0, rp=(0, 0)):
     '''
-    Get a transformation matrix for the specified rotation of r degrees
-    about a pivot point rp.
+    Get the RigidTransform and transformation matrix for a translation t and
+    a rotation of r degrees about the pivot point rp. Recently used
+    combinations are cached, so the returned matrix must not be modified.
     '''
+    key = (tuple(t), r, tuple(rp))
+    try:
+        cached = _transform_cache.pop(key)
+    except KeyError:
+        rigid_transform = RigidTransform.from_params(t=t, r=r, rp=rp)
+        matrix = rigid_transform.get_matrix()
+        matrix.setflags(write=False)
+        cached = (rigid_transform, matrix)
+        if len(_transform_cache) >= TRANSFORM_CACHE_SIZE:
+            _transform_cache.popitem(last=False)
+    _transform_cache[key] = cached
+    return cached
+
+def get_transform_matrix(t=(0, 0), r=0, rp=(0, 0)):
     '''
-    rp_matrix = identity(3)
-    rp_matrix[:2, 2] = array(rp)
+    Get the (cached, read-only) transformation matrix for a translation t and
+    a rotation of r degrees about the pivot point rp.
     '''
-    rp_matrix = get_translation_matrix(t = rp)
+    return get_transform(t=t, r=r, rp=rp)[1]
 
-    # r is negated because of KiCAD's rotation direction
-    r = -radians(r)
-
-    s = sin(r)
+def rotate_about_pivot(px, py, rotation, rpx, rpy):
+    '''
+    Rotate a point (px, py) about the point (rpx, rpy) by rotation degrees.
+    '''
+    r = radians(rotation)
     c = cos(r)
-    r_matrix = array([[c, -s, 0],
-                      [s,  c, 0],
-                      [0,  0, 1]])
+    s = sin(r)
+    dx = px - rpx
+    dy = py - rpy
+    return (around(c * dx - s * dy + rpx, 5), around(s * dx + c * dy + rpy, 5))
 
-    return rp_matrix.dot(r_matrix).dot(inv(rp_matrix))
+def get_rotation_matrix(r = 0, rp = (0, 0)):
+    '''
+    Get a transformation matrix for the specified rotation of r degrees
+    about a pivot point rp.
+    '''
+    return RigidTransform.from_params(r=r, rp=rp).get_matrix()
 
 def get_translation_matrix(t = (0, 0)):
     '''
@@ -60,15 +129,141 @@ def get_translation_matrix(t = (0, 0)):
     return t_matrix
 
 def transform(list_of_transformables, t=(0,0), r=0, rp=(0,0)):
+    '''
+    Transform every Transformable in list_of_transformables the same way.
+
+    The transformation matrix is built once, and the points of all the
+    transformables are transformed together with a single matrix product.
+    '''
+    transform_with_matrix(list_of_transformables, get_transform_matrix(t=t, r=r, rp=rp), r)
+
+def transform_with_matrix(list_of_transformables, matrix, r=0):
+    '''
+    Apply a 3x3 transformation matrix to every Transformable in
+    list_of_transformables. r is the rotation in degrees that matrix contains,
+    which is added to the rotation of transformables that have one.
+    '''
+    list_of_transformables = list(list_of_transformables)
+    counts = []
+    points = []
     for transformable in list_of_transformables:
-        transformable.transform(t, r, rp)
+        transformable_points = transformable.get_transform_points()
+        counts.append(len(transformable_points))
+        points.extend(transformable_points)
+
+    if not points:
+        return
+    # adding zero turns the -0.0 that rounding can produce into 0.0
+    transformed = array(points, dtype=float).dot(matrix.T).round(5) + 0.0
+
+    i = 0
+    for transformable, count in zip(list_of_transformables, counts):
+        transformable.set_transform_points(transformed[i:i + count], r)
+        i += count
 
 def transform_point(x, y, t=(0,0), r=0, rp=(0,0)):
-    T = get_translation_matrix(t=t)
-    R = get_rotation_matrix(r=r, rp=rp)
-    transform = T.dot(R)
+    x, y = get_transform(t=t, r=r, rp=rp)[0].apply(x, y)
+    return (around(x, 5), around(y, 5))
+
+# Sessions with transforms that haven't been committed yet. They are held
+# here until they are committed or discarded, so that write_file still
+# applies the transforms of a session that went out of scope.
+_open_sessions = []
+
+class TransformSession(object):
+    '''
+    Collects transforms of Transformables without applying them. Every
+    object's transforms are composed into one, which is applied when the
+    session is committed, so each object is only rounded and written to its
+    KicadPcbNode once.
+
+    Until then, the objects keep their old positions. write_file commits the
+    open sessions that transform objects of the tree it writes first.
+
+    Usage:
+        with TransformSession() as session:
+            session.transform(left_side, t=(dx, dy))
+            session.transform(left_side, r=-10, rp=pivot)
+    '''
+    def __init__(self):
+        # transformable -> (RigidTransform, total rotation in degrees)
+        self._pending = OrderedDict()
+
+    def transform(self, list_of_transformables, t=(0,0), r=0, rp=(0,0)):
+        '''
+        Add a transform of every Transformable in list_of_transformables,
+        after any transforms already added for them.
+        '''
+        rigid_transform = get_transform(t=t, r=r, rp=rp)[0]
+        pending = self._pending
+        for transformable in list_of_transformables:
+            previous = pending.get(transformable)
+            if previous is None:
+                pending[transformable] = (rigid_transform, r)
+            else:
+                pending[transformable] = (rigid_transform.compose(previous[0]), previous[1] + r)
+        if pending and self not in _open_sessions:
+            _open_sessions.append(self)
+
+    def get_transform(self, transformable):
+        '''
+        Return the RigidTransform pending for transformable, or None.
+        '''
+        previous = self._pending.get(transformable)
+        return previous[0] if previous is not None else None
+
+    def get_transformables(self):
+        ''' Return the list of objects with pending transforms. '''
+        return list(self._pending)
 
-    return tuple(transform.dot(array([x, y, 1])).round(5)[:2])
+    def transform_point(self, transformable, x, y):
+        '''
+        Transform the point (x, y) by the transform pending for
+        transformable, e.g. to get where a module will be after the commit.
+        '''
+        rigid_transform = self.get_transform(transformable)
+        if rigid_transform is not None:
+            x, y = rigid_transform.apply(x, y)
+        return (around(x, 5), around(y, 5))
+
+    def commit(self):
+        '''
+        Apply the pending transforms. Returns the transformed objects as a
+        list of batches, each the list of objects that were moved by the same
+        transform, e.g. to update a ConnectivityGraph one batch at a time.
+        '''
+        # objects moved the same way are transformed together
+        batches = OrderedDict()
+        for transformable, (rigid_transform, r) in self._pending.items():
+            key = (rigid_transform.cos, rigid_transform.sin,
+                   rigid_transform.tx, rigid_transform.ty, r)
+            batches.setdefault(key, (rigid_transform, r, []))[2].append(transformable)
+
+        self.discard()
+        for rigid_transform, r, batch in batches.values():
+            transform_with_matrix(batch, rigid_transform.get_matrix(), r)
+        return [batch for _, _, batch in batches.values()]
+
+    def discard(self):
+        ''' Forget the pending transforms without applying them. '''
+        self._pending.clear()
+        if self in _open_sessions:
+            _open_sessions.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+def get_open_sessions():
+    '''
+    Return the list of TransformSessions that have pending transforms.
+    '''
+    return list(_open_sessions)
 
 class Transformable(object):
     '''
@@ -89,3 +284,16 @@ class Transformable(object):
         All of these default to zero.
         """
         pass
+
+    @abstractmethod
+    def get_transform_points(self):
+        """Return the points that define this object's position, as a list
+        of homogeneous (x, y, 1) coordinates."""
+        pass
+
+    @abstractmethod
+    def set_transform_points(self, points, r):
+        """Update this object from its transformed points, in the same order
+        as returned by get_transform_points. r is the rotation in degrees that
+        was applied to them."""
+        pass
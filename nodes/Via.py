@@ -3,7 +3,7 @@ Classes and functions related to kicad_pcb via nodes.
 '''
 from nodes.KicadPcbNode import KicadPcbNode, find_nodes
 from numpy import array
-from nodes.Transform2d import Transformable, get_rotation_matrix, get_translation_matrix
+from nodes.Transform2d import Transformable, get_transform_matrix
 
 def find_vias(nodes):
     ''' Get a list of Vias from a list of KicadPcbNodes. '''
@@ -46,11 +46,16 @@ class Via(Transformable):
         return cls(node)
 
     def transform(self, t=(0, 0), r=0, rp=(0, 0)):
-        T = get_translation_matrix(t=t)
-        R = get_rotation_matrix(r=r, rp=rp)
-        transform = T.dot(R)
+        transform = get_transform_matrix(t=t, r=r, rp=rp)
 
-        self.position = transform.dot(self.position).round(5)
+        self.position = transform.dot(self.position).round(5) + 0.0
+        self._update_node()
+
+    def get_transform_points(self):
+        return [self.position]
+
+    def set_transform_points(self, points, r):
+        self.position, = points
         self._update_node()
 
     def _update_node(self):
@@ -59,6 +64,12 @@ class Via(Transformable):
     def get_position(self):
         return tuple(self.position[:2])
 
+    def get_bounding_box(self):
+        '''Return (min x, min y, max x, max y) of this via.'''
+        x, y = self.get_position()
+        radius = self.size / 2.0
+        return (x - radius, y - radius, x + radius, y + radius)
+
     def __str__(self):
         return "Via(%f, %f)" % self.get_position()
 
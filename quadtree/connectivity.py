@@ -0,0 +1,211 @@
+'''
+Precomputed connectivity of Segments, Vias and Module pads.
+'''
+from nodes.Module import Module
+from nodes.Segment import Segment
+from nodes.Via import Via
+from hashgrid import HashGrid, grid_join
+from quadtree import EPSILON, get_positions, get_position_layers
+
+class ConnectivityGraph(object):
+    '''
+    The connected components of a set of Segments, Vias and Modules, kept in
+    a disjoint-set forest.
+
+    Every segment end, via and module pad is a vertex, which is on a set of
+    copper layers: a segment on its layer, a via on every layer it spans and
+    a pad on the copper layers it lists. Vertices within EPSILON of each
+    other on a common copper layer are connected, and so are the two ends of
+    a segment. The pads of a module are separate vertices and aren't
+    connected to each other.
+
+    The vertices are partitioned by layer, so vertices are only ever
+    compared with the others on the same layers.
+    '''
+    def __init__(self, nodes, epsilon=EPSILON):
+        self.epsilon = epsilon
+        # vertex id -> node, position, copper layers, net and parent in the forest
+        self._vertex_nodes = []
+        self._positions = []
+        self._layers = []
+        self._nets = []
+        self._parents = []
+        # node -> list of its vertex ids
+        self._vertex_ids = {}
+        # root vertex id -> list of the vertex ids in its component
+        self._members = {}
+
+        for node in nodes:
+            self._add_node(node)
+        self._members = dict((vertex, [vertex]) for vertex in range(len(self._parents)))
+
+        # Layers that exactly the same vertices are on (e.g. inner layers
+        # with only through-hole pads and vias) are handled as one group.
+        self._layer_groups = _group_layers(set(self._layers))
+        # frozenset of layers -> indices of the layer groups it is in
+        self._layer_group_indices = {}
+        # layer group index -> HashGrid of vertex ids, built on the first update
+        self._grids = None
+
+        for node in self._vertex_ids:
+            self._union_node(node)
+
+        group_vertices = [[] for _ in self._layer_groups]
+        for vertex, layers in enumerate(self._layers):
+            for group_index in self._get_layer_group_indices(layers):
+                group_vertices[group_index].append(vertex)
+        for vertices in group_vertices:
+            positions = [self._positions[vertex] for vertex in vertices]
+            query_indices, point_indices = grid_join(positions, positions, epsilon)
+            for a, b in zip(query_indices.tolist(), point_indices.tolist()):
+                if a < b:
+                    self._union(vertices[a], vertices[b])
+
+    def _add_node(self, node):
+        positions = get_positions(node)
+        layers = get_position_layers(node)
+        if isinstance(node, Segment):
+            nets = [node.net] * 2
+        elif isinstance(node, Via):
+            nets = [node.net]
+        elif isinstance(node, Module):
+            nets = node.get_pad_nets()
+
+        first = len(self._parents)
+        self._vertex_ids[node] = range(first, first + len(positions))
+        for position, vertex_layers, net in zip(positions, layers, nets):
+            self._parents.append(len(self._parents))
+            self._vertex_nodes.append(node)
+            self._positions.append(position)
+            self._layers.append(vertex_layers)
+            self._nets.append(net)
+
+    def _get_layer_group_indices(self, layers):
+        indices = self._layer_group_indices.get(layers)
+        if indices is None:
+            indices = self._layer_group_indices[layers] = \
+                [i for i, group in enumerate(self._layer_groups) if layers & group]
+        return indices
+
+    def _union_node(self, node):
+        # the ends of a segment are always connected
+        if isinstance(node, Segment):
+            start, end = self._vertex_ids[node]
+            self._union(start, end)
+
+    def _find(self, vertex):
+        parents = self._parents
+        while parents[vertex] != vertex:
+            # path halving
+            parents[vertex] = parents[parents[vertex]]
+            vertex = parents[vertex]
+        return vertex
+
+    def _union(self, a, b):
+        root_a = self._find(a)
+        root_b = self._find(b)
+        if root_a == root_b:
+            return
+        members = self._members
+        if len(members[root_a]) < len(members[root_b]):
+            root_a, root_b = root_b, root_a
+        self._parents[root_b] = root_a
+        members[root_a].extend(members.pop(root_b))
+
+    def _get_grids(self):
+        if self._grids is None:
+            self._grids = [HashGrid(self.epsilon) for _ in self._layer_groups]
+            for vertex, position in enumerate(self._positions):
+                for group_index in self._get_layer_group_indices(self._layers[vertex]):
+                    self._grids[group_index].insert(position, vertex)
+        return self._grids
+
+    def get_connected(self, modules, desired_return_types=(Segment, Via), nets=None):
+        '''
+        Return the set of modules and every node of desired_return_types
+        that is connected to one of their pads.
+
+        If nets is given, only the pads on those nets are started from and
+        only segments and vias on those nets are returned. The components
+        themselves don't depend on nets: a track on another net that touches
+        two groups on a common layer still joins them, and the nodes of the
+        joined group that are on nets are returned.
+        '''
+        connected = set(modules)
+        seen_roots = set()
+        vertex_nodes = self._vertex_nodes
+        vertex_nets = self._nets
+        for module in modules:
+            for vertex in self._vertex_ids[module]:
+                if nets is not None and vertex_nets[vertex] not in nets:
+                    continue
+                root = self._find(vertex)
+                if root in seen_roots:
+                    continue
+                seen_roots.add(root)
+                for member in self._members[root]:
+                    node = vertex_nodes[member]
+                    if type(node) in desired_return_types and \
+                       (nets is None or vertex_nets[member] in nets): # pylint: disable=unidiomatic-typecheck
+                        connected.add(node)
+        return connected
+
+    def update(self, nodes):
+        '''
+        Update the graph after nodes have moved. The nodes must all have
+        been moved by the same transform; update groups of nodes that were
+        moved differently separately, e.g. every batch that
+        TransformSession.commit returns.
+
+        Connections within a group of nodes that moved together are kept as
+        they are, since rigid transforms don't change them; components that
+        only partly moved are rebuilt. Either way, the moved vertices are
+        then connected to whatever they now coincide with.
+        '''
+        grids = self._get_grids()
+        moved = set(nodes)
+        moved_vertices = []
+        for node in moved:
+            vertices = self._vertex_ids[node]
+            new_positions = get_positions(node)
+            if len(new_positions) != len(vertices):
+                raise Exception('%s has %d positions instead of %d.' %
+                                (node, len(new_positions), len(vertices)))
+            for vertex, position in zip(vertices, new_positions):
+                for group_index in self._get_layer_group_indices(self._layers[vertex]):
+                    grids[group_index].remove(self._positions[vertex], vertex)
+                    grids[group_index].insert(position, vertex)
+                self._positions[vertex] = position
+            moved_vertices.extend(vertices)
+
+        rebuilt_vertices = []
+        for root in set(self._find(vertex) for vertex in moved_vertices):
+            members = self._members[root]
+            if all(self._vertex_nodes[member] in moved for member in members):
+                continue
+            # split the component back up into single vertices
+            del self._members[root]
+            for member in members:
+                self._parents[member] = member
+                self._members[member] = [member]
+            rebuilt_vertices.extend(members)
+
+        for node in set(self._vertex_nodes[vertex] for vertex in rebuilt_vertices):
+            self._union_node(node)
+        for vertex in moved_vertices + rebuilt_vertices:
+            position = self._positions[vertex]
+            for group_index in self._get_layer_group_indices(self._layers[vertex]):
+                for other in grids[group_index].lookup(position, self.epsilon):
+                    self._union(vertex, other)
+
+def _group_layers(layer_sets):
+    '''
+    Split the layers in layer_sets into groups of layers that are in
+    exactly the same sets, and return the groups as a list of frozensets.
+    '''
+    layer_sets = list(layer_sets)
+    groups = {}
+    for layer in set().union(*layer_sets):
+        signature = frozenset(i for i, layer_set in enumerate(layer_sets) if layer in layer_set)
+        groups.setdefault(signature, set()).add(layer)
+    return [frozenset(group) for group in groups.values()]
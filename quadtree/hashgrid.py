@@ -0,0 +1,136 @@
+'''
+A hash grid of positions, for when connected means "at the same position,
+give or take epsilon".
+'''
+import math
+import numpy
+
+class HashGrid(object):
+    '''
+    Positions snapped to a grid of square cells, stored in a dict keyed by
+    cell. Lookups only check the cells that the epsilon box around the
+    position overlaps, which for epsilon no bigger than the cell size is at
+    most four, and inserting and removing only touch one cell.
+
+    This has the same insert, remove, relocate_many and lookup methods as
+    QuadtreeNode.
+    '''
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise Exception('Cell size must be positive, got %r.' % cell_size)
+        self.cell_size = float(cell_size)
+        # (column, row) -> list of (position, node)
+        self.cells = {}
+
+    def _get_cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def insert(self, position, node):
+        cell = self._get_cell(position[0], position[1])
+        entries = self.cells.get(cell)
+        if entries is None:
+            self.cells[cell] = [(position, node)]
+        else:
+            entries.append((position, node))
+
+    def remove(self, position, node):
+        cell = self._get_cell(position[0], position[1])
+        entries = self.cells.get(cell)
+        if entries is None:
+            return
+        # compared by value, so that nodes can also be e.g. ints
+        entries[:] = [entry for entry in entries if entry[1] != node]
+        if not entries:
+            del self.cells[cell]
+
+    def relocate_many(self, moves):
+        '''
+        Move entries, given as a list of (old position, new position, node).
+        '''
+        for old_position, new_position, node in moves:
+            old_cell = self._get_cell(old_position[0], old_position[1])
+            entries = self.cells.get(old_cell, [])
+            for i, (position, entry_node) in enumerate(entries):
+                if entry_node == node and position == old_position:
+                    if self._get_cell(new_position[0], new_position[1]) == old_cell:
+                        entries[i] = (new_position, node)
+                    else:
+                        del entries[i]
+                        if not entries:
+                            del self.cells[old_cell]
+                        self.insert(new_position, node)
+                    break
+
+    def lookup(self, position, epsilon):
+        x, y = position[0], position[1]
+        min_column, min_row = self._get_cell(x - epsilon, y - epsilon)
+        max_column, max_row = self._get_cell(x + epsilon, y + epsilon)
+
+        found = []
+        cells = self.cells
+        hypot = math.hypot
+        for column in range(min_column, max_column + 1):
+            for row in range(min_row, max_row + 1):
+                entries = cells.get((column, row))
+                if entries is None:
+                    continue
+                for (entry_x, entry_y), node in entries:
+                    if hypot(entry_x - x, entry_y - y) <= epsilon:
+                        found.append(node)
+        return found
+
+def grid_join(points, queries, epsilon):
+    '''
+    Find all pairs of points and queries that are within epsilon of each
+    other. Returns arrays of query indices and point indices, sorted by query
+    index and then point index.
+    '''
+    points = numpy.array(points, dtype=float).reshape(-1, 2)
+    queries = numpy.array(queries, dtype=float).reshape(-1, 2)
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    if not len(points) or not len(queries):
+        return (empty, empty)
+
+    # every point within epsilon of a query is in the query's cell or one of
+    # the 8 cells around it
+    cell_size = epsilon if epsilon > 0 else 1.0
+    point_cells = numpy.floor(points / cell_size).astype(numpy.int64)
+    query_cells = numpy.floor(queries / cell_size).astype(numpy.int64)
+
+    # number the cells row by row, with a margin for the neighbouring cells
+    low = numpy.minimum(point_cells.min(axis=0), query_cells.min(axis=0)) - 1
+    high = numpy.maximum(point_cells.max(axis=0), query_cells.max(axis=0)) + 1
+    columns = high[1] - low[1] + 1
+    def _cell_keys(cells):
+        return (cells[:, 0] - low[0]) * columns + (cells[:, 1] - low[1])
+
+    point_keys = _cell_keys(point_cells)
+    order = numpy.argsort(point_keys, kind='mergesort')
+    sorted_keys = point_keys[order]
+
+    query_indices = []
+    point_indices = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            keys = _cell_keys(query_cells + (dx, dy))
+            starts = numpy.searchsorted(sorted_keys, keys, 'left')
+            counts = numpy.searchsorted(sorted_keys, keys, 'right') - starts
+            total = counts.sum()
+            if not total:
+                continue
+            # one candidate pair for every point in the neighbouring cell
+            pair_queries = numpy.repeat(numpy.arange(len(queries)), counts)
+            offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            pair_points = order[numpy.repeat(starts, counts) + offsets]
+
+            delta = points[pair_points] - queries[pair_queries]
+            close = numpy.hypot(delta[:, 0], delta[:, 1]) <= epsilon
+            query_indices.append(pair_queries[close])
+            point_indices.append(pair_points[close])
+
+    if not query_indices:
+        return (empty, empty)
+    query_indices = numpy.concatenate(query_indices)
+    point_indices = numpy.concatenate(point_indices)
+    pair_order = numpy.lexsort((point_indices, query_indices))
+    return (query_indices[pair_order], point_indices[pair_order])
@@ -0,0 +1,88 @@
+'''
+A static, balanced k-d tree over a fixed set of points.
+
+The tree is built in one go from all of the points, so unlike Quadtree it
+doesn't depend on the order in which points arrive. It is implicit: the
+points are reordered so that every node of the tree is a contiguous range of
+them, split at its median, and only the split axis and value of each node
+are stored.
+'''
+import math
+from numpy import arange, argpartition, array
+
+# ranges of at most this many points are searched linearly
+LEAF_SIZE = 16
+
+class KdTree(object):
+    '''
+    A k-d tree mapping (x, y) positions to values. Several positions may map
+    to the same value.
+    '''
+    def __init__(self, positions, values):
+        '''
+        positions is a sequence of (x, y) positions, and values the sequence
+        of values for those positions.
+        '''
+        points = array(positions, dtype=float).reshape(-1, 2)
+        if len(points) != len(values):
+            raise Exception('Got %d positions but %d values.' % (len(points), len(values)))
+
+        order = arange(len(points))
+        # heap index (children of i are 2i and 2i + 1) -> (axis, split value)
+        self._splits = {}
+        stack = [(0, len(points), 1)]
+        while stack:
+            lo, hi, i = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            indices = order[lo:hi]
+            range_points = points[indices]
+            # split along the axis the points are most spread out on
+            spread = range_points.max(axis=0) - range_points.min(axis=0)
+            axis = 0 if spread[0] >= spread[1] else 1
+
+            mid = (lo + hi) // 2
+            partition = argpartition(range_points[:, axis], mid - lo)
+            order[lo:hi] = indices[partition]
+            self._splits[i] = (axis, points[order[mid], axis])
+            stack.append((lo, mid, 2 * i))
+            stack.append((mid, hi, 2 * i + 1))
+
+        # plain lists are faster than arrays for the per-point work in lookup
+        self._xs = points[order, 0].tolist()
+        self._ys = points[order, 1].tolist()
+        self._values = [values[j] for j in order.tolist()]
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, position, epsilon):
+        '''
+        Return the values of all positions within epsilon of position.
+        '''
+        x, y = position[0], position[1]
+        xs = self._xs
+        ys = self._ys
+        values = self._values
+        splits = self._splits
+        hypot = math.hypot
+
+        found = []
+        stack = [(0, len(values), 1)]
+        while stack:
+            lo, hi, i = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                for j in range(lo, hi):
+                    if hypot(xs[j] - x, ys[j] - y) <= epsilon:
+                        found.append(values[j])
+                continue
+
+            axis, split = splits[i]
+            coordinate = y if axis else x
+            mid = (lo + hi) // 2
+            # points equal to the split value can be on either side
+            if coordinate + epsilon >= split:
+                stack.append((mid, hi, 2 * i + 1))
+            if coordinate - epsilon <= split:
+                stack.append((lo, mid, 2 * i))
+        return found
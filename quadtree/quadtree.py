@@ -5,10 +5,18 @@ import math
 from nodes.Segment import Segment
 from nodes.Via import Via
 from nodes.Module import Module
+from nodes.Layers import get_copper_layers, get_via_copper_layers
+from kdtree import KdTree
+from hashgrid import HashGrid, grid_join
+from rtree import RTree
 
 MAX_NODE_SIZE = 5
 EPSILON = 0.001
 
+# 'tree' keeps positions in QuadtreeNodes (and a KdTree, when bulk loaded),
+# 'hashgrid' in a HashGrid with EPSILON sized cells
+BACKENDS = ('tree', 'hashgrid')
+
 DEBUG = False
 
 def _log(msg):
@@ -16,86 +24,213 @@ def _log(msg):
         print msg
 
 class Quadtree(object):
-    def __init__(self):
-        self.root = QuadtreeNode()
+    def __init__(self, backend='tree'):
+        if backend == 'tree':
+            self.root = QuadtreeNode()
+        elif backend == 'hashgrid':
+            self.root = HashGrid(EPSILON)
+        else:
+            raise Exception("Unknown backend '%s'; expected one of %s." %
+                            (backend, ', '.join(BACKENDS)))
+        self.backend = backend
         self.contents = {}
+        # KdTree of the nodes given to bulk_load, if it was used
+        self.static_index = None
+        self._static_nodes = set()
+        # static nodes whose positions in static_index are out of date
+        self._moved_nodes = set()
+        # types (or None for all nodes) -> RTree of the bounding boxes of
+        # those nodes, built when first queried
+        self._box_indices = {}
 
-    def insert(self, node):
-        if isinstance(node, Segment):
-            positions = [node.get_start(), node.get_end()]
-        elif isinstance(node, Via):
-            positions = [node.get_position()]
-        elif isinstance(node, Module):
-            positions = node.get_pad_positions()
-        else:
-            raise Exception("Cannot insert")
+    @classmethod
+    def bulk_load(cls, nodes, backend='tree'):
+        '''
+        Build a Quadtree of nodes all at once. With the tree backend, the
+        positions are put in a balanced KdTree instead of being inserted one
+        at a time; nodes that are inserted or updated later go in the regular
+        tree. A hash grid is cheap to insert into, so it is just filled.
+        '''
+        quadtree = cls(backend=backend)
+        if backend == 'hashgrid':
+            for node in nodes:
+                quadtree.insert(node)
+            return quadtree
 
+        positions = []
+        values = []
+        for node in nodes:
+            node_positions = get_positions(node)
+            positions.extend(node_positions)
+            values.extend([node] * len(node_positions))
+            quadtree.contents[node] = node_positions
+        quadtree.static_index = KdTree(positions, values)
+        quadtree._static_nodes = set(quadtree.contents)
+        return quadtree
+
+    def insert(self, node):
+        self._box_indices = {}
+        positions = get_positions(node)
         for position in positions:
             self.root.insert(position, node)
         self.contents[node] = positions
 
     def update(self, node):
         '''Update node's position.'''
-        for old_position in self.contents[node]:
-            self.root.remove(old_position, node)
+        self.bulk_update([node])
+
+    def bulk_update(self, nodes):
+        '''
+        Update the positions of nodes, e.g. after transforming them as a
+        group. All of the moves are made in one pass over the tree, and
+        positions that don't leave their part of the tree are moved in place.
+        '''
+        self._box_indices = {}
+        moves = []
+        for node in nodes:
+            old_positions = self.contents[node]
+            new_positions = get_positions(node)
+            self.contents[node] = new_positions
+
+            if node in self._static_nodes and node not in self._moved_nodes:
+                # the static index can't be changed; just ignore the node there
+                self._moved_nodes.add(node)
+                for position in new_positions:
+                    self.root.insert(position, node)
+            elif len(old_positions) == len(new_positions):
+                moves.extend(zip(old_positions, new_positions, [node] * len(new_positions)))
+            else:
+                for old_position in old_positions:
+                    self.root.remove(old_position, node)
+                for position in new_positions:
+                    self.root.insert(position, node)
 
-        del self.contents[node]
-        self.insert(node)
+        if moves:
+            self.root.relocate_many(moves)
 
 
     def lookup(self, position, epsilon=EPSILON):
-        return self.root.lookup(position, epsilon)
+        found = self.root.lookup(position, epsilon)
+        if self.static_index is not None:
+            moved_nodes = self._moved_nodes
+            found.extend(node for node in self.static_index.lookup(position, epsilon) \
+                         if node not in moved_nodes)
+        return found
+
+    def lookup_many(self, positions, epsilon=EPSILON):
+        '''
+        Look up many positions at once. Returns a list with, for every
+        position, the list of nodes that lookup would return for it.
+
+        Rather than walking the tree for every position, all of the indexed
+        positions and the queried positions are snapped to a grid of
+        epsilon-sized cells and matched up cell by cell with NumPy.
+        '''
+        points = []
+        owners = []
+        for node, node_positions in self.contents.items():
+            points.extend(node_positions)
+            owners.extend([node] * len(node_positions))
+
+        query_indices, point_indices = grid_join(points, positions, epsilon)
+        found = [[] for _ in range(len(positions))]
+        for query_index, point_index in zip(query_indices.tolist(), point_indices.tolist()):
+            found[query_index].append(owners[point_index])
+        return found
+
+    def _get_box_index(self, types):
+        # nodes of every combination of types get an RTree of their own, so
+        # that e.g. looking for the nearest vias doesn't wade through segments
+        box_index = self._box_indices.get(types)
+        if box_index is None:
+            nodes = list(self.contents)
+            if types is not None:
+                nodes = [node for node in nodes if isinstance(node, types)]
+            box_index = RTree([node.get_bounding_box() for node in nodes], nodes)
+            self._box_indices[types] = box_index
+        return box_index
+
+    def query_rectangle(self, rectangle, types=None):
+        '''
+        Return the nodes whose bounding boxes intersect rectangle, which is
+        (min x, min y, max x, max y). Segments are covered along their whole
+        length and width, not just at their ends. If types is given, only
+        nodes of those types are returned.
+        '''
+        return self.query_rectangles([rectangle], types)[0]
+
+    def query_rectangles(self, rectangles, types=None):
+        '''
+        Query many rectangles at once. Returns a list with the result of
+        query_rectangle for every rectangle.
+        '''
+        return self._get_box_index(types).query_many(rectangles)
+
+    def nearest(self, position, k=1, types=None):
+        '''
+        Return the k nodes nearest to position, nearest first, measuring the
+        distance to their bounding boxes. If types is given, only nodes of
+        those types are returned, e.g. nearest(pad, 3, types=Via).
+        '''
+        return self.nearest_many([position], k, types)[0]
+
+    def nearest_many(self, positions, k=1, types=None):
+        '''
+        Return a list with the result of nearest for every position.
+        '''
+        return self._get_box_index(types).nearest_many(positions, k)
 
     def get_connected(self, modules, desired_return_types=(Segment, Via)):
-        positions = []
-        for module in modules:
-            pad_positions = [(pad_position, module) for pad_position in module.get_pad_positions()]
-            positions.extend(pad_positions)
-        visited_positions = set()
+        '''
+        Return the set of modules and every node of desired_return_types that
+        is connected to one of their pads, found by flooding outwards from the
+        pads with lookup.
 
+        Positions within EPSILON of each other are only connected on a copper
+        layer they have in common, and the two ends of a segment are always
+        connected, so the result is the same as that of
+        ConnectivityGraph.get_connected. The modules don't have to be in the
+        Quadtree.
+        '''
         connected = set(modules)
-        try:
-            current_position, current_node = positions.pop()
-            visited_positions.add(current_position)
-        except IndexError:
-            return connected
-
-        while current_position is not None:
-            connected_nodes = self.lookup(current_position)
-            for connected_node in connected_nodes:
-                if type(connected_node) in desired_return_types:
-                    connected.add(connected_node)
-                    if isinstance(connected_node, Segment):
-                        positions.append((connected_node.get_other_end(current_position), connected_node))
-                        # strictly speaking, there should probably be a net or layer check here so
-                        # that we don't add an unrelated segment on the other side of the board
-                        # that's not actually connected -- but I don't think that's necessary for the
-                        # current use case
-                else:
-                    continue
+        # (node, index of the position) for every position reached
+        visited = set()
+        pending = []
+        for module in modules:
+            pad_layers = get_position_layers(module)
+            for i, position in enumerate(module.get_pad_positions()):
+                visited.add((module, i))
+                pending.append((position, pad_layers[i]))
 
-            current_position, current_node = self._get_next_position(positions, visited_positions)
+        contents = self.contents
+        # node -> get_position_layers(node), for the nodes seen so far
+        node_layers = {}
+        while pending:
+            position, layers = pending.pop()
+            for node in self.lookup(position):
+                layers_of_node = node_layers.get(node)
+                if layers_of_node is None:
+                    layers_of_node = node_layers[node] = get_position_layers(node)
+                node_positions = contents[node]
+                if isinstance(node, Segment):
+                    # both ends are reached at once, since they are connected
+                    if (node, 0) in visited or not layers & layers_of_node[0]:
+                        continue
+                    reached = [0, 1]
+                else:
+                    reached = [i for i, other in enumerate(node_positions) \
+                               if (node, i) not in visited and layers & layers_of_node[i] \
+                               and _distance(other, position) <= EPSILON]
+                    if not reached:
+                        continue
 
+                if type(node) in desired_return_types: # pylint: disable=unidiomatic-typecheck
+                    connected.add(node)
+                for i in reached:
+                    visited.add((node, i))
+                    pending.append((node_positions[i], layers_of_node[i]))
         return connected
 
-    @staticmethod
-    def _contains_module(nodes):
-        for node in nodes:
-            if isinstance(node, Module):
-                return True
-        return False
-
-    @staticmethod
-    def _get_next_position(positions, visited_positions):
-        try:
-            next_position, next_node = positions.pop()
-            while next_position in visited_positions:
-                next_position, next_node = positions.pop()
-            visited_positions.add(next_position)
-            return (next_position, next_node)
-        except IndexError:
-            return (None, None)
-
 '''
      ^
      |
@@ -111,37 +246,93 @@ class QuadtreeNode(object):
         self.leaves = []
         self.quadrants = []
         self.splitpoint = None
+        # number of leaves in this subtree
+        self.size = 0
 
     def insert(self, position, node):
+        self.size += 1
         if not self._is_split():
-            if len(self.leaves) < MAX_NODE_SIZE:
-                self.leaves.append(QuadtreeLeaf(position, node))
-                return
-            else:
+            self.leaves.append(QuadtreeLeaf(position, node))
+            if len(self.leaves) > MAX_NODE_SIZE:
                 self._split()
+            return
         self._get_quadrant(position).insert(position, node)
 
     def remove(self, position, node):
+        '''
+        Remove the leaf for node at position. Returns whether there was one.
+        '''
         if not self._is_split():
-            self.leaves = [leaf for leaf in self.leaves if leaf.node is not node]
-        else:
-            self._get_quadrant(position).remove(position, node)
+            for i, leaf in enumerate(self.leaves):
+                if leaf.node is node and leaf.position == position:
+                    del self.leaves[i]
+                    self.size -= 1
+                    return True
+            return False
+
+        if not self._get_quadrant(position).remove(position, node):
+            return False
+        self.size -= 1
+        if self.size <= MAX_NODE_SIZE:
+            self._merge()
+        return True
+
+    def relocate_many(self, moves):
+        '''
+        Move leaves, given as a list of (old position, new position, node).
+        Leaves that stay in the same quadrant all the way down are moved in
+        place; the others are removed and inserted again below the deepest
+        quadrant that holds both positions.
+        '''
+        if not self._is_split():
+            for old_position, new_position, node in moves:
+                for leaf in self.leaves:
+                    if leaf.node is node and leaf.position == old_position:
+                        leaf.position = new_position
+                        break
+            return
+
+        staying = [[], [], [], []]
+        leaving = [[], [], [], []]
+        arriving = [[], [], [], []]
+        for move in moves:
+            old_index = self._get_quadrant_index(move[0])
+            new_index = self._get_quadrant_index(move[1])
+            if old_index == new_index:
+                staying[old_index].append(move)
+            else:
+                leaving[old_index].append(move)
+                arriving[new_index].append(move)
+
+        for i, quadrant in enumerate(self.quadrants):
+            if staying[i]:
+                quadrant.relocate_many(staying[i])
+            for old_position, _, node in leaving[i]:
+                quadrant.remove(old_position, node)
+            for _, new_position, node in arriving[i]:
+                quadrant.insert(new_position, node)
 
     def lookup(self, position, epsilon=EPSILON):
         if self._is_split():
-            return self._get_quadrant(position).lookup(position, epsilon)
+            found = []
+            for quadrant in self._get_quadrants_near(position, epsilon):
+                found.extend(quadrant.lookup(position, epsilon))
+            return found
         else:
             return [qleaf.node for qleaf in self.leaves \
                     if _distance(qleaf.position, position) <= epsilon]
-        # TODO this will miss the cases where the point is within epsilon distance
-        # of this qnode's boundary
-        # but this is fine for our use case since we generally don't have non-equal
-        # points that close together
 
     def insert_leaf(self, qleaf):
+        self.size += 1
         self.leaves.append(qleaf)
 
     def _split(self):
+        # Leaves at the same position can't be split up; let this node grow.
+        # Otherwise the mean has points on both sides of it in x or y.
+        first_position = self.leaves[0].position
+        if all(leaf.position == first_position for leaf in self.leaves):
+            return
+
         # average positions of children -- this is the split point
         self.splitpoint = (_mean([leaf.position[0] for leaf in self.leaves]),
                            _mean([leaf.position[1] for leaf in self.leaves]))
@@ -151,7 +342,22 @@ class QuadtreeNode(object):
             self._get_quadrant(leaf.position).insert_leaf(leaf)
         self.leaves = []
     
+    def _merge(self):
+        # collect the leaves of the whole subtree back into this node
+        leaves = []
+        stack = list(self.quadrants)
+        while stack:
+            quadrant = stack.pop()
+            leaves.extend(quadrant.leaves)
+            stack.extend(quadrant.quadrants)
+        self.leaves = leaves
+        self.quadrants = []
+        self.splitpoint = None
+
     def _get_quadrant(self, point):
+        return self.quadrants[self._get_quadrant_index(point)]
+
+    def _get_quadrant_index(self, point):
         X = self.splitpoint[0]
         Y = self.splitpoint[1]
         x = point[0]
@@ -159,14 +365,40 @@ class QuadtreeNode(object):
 
         if x >= X:
             if y >= Y:
-                return self.quadrants[1]
+                return 1
             else:
-                return self.quadrants[3]
+                return 3
         else:
             if y >= Y:
-                return self.quadrants[0]
+                return 0
             else:
-                return self.quadrants[2]
+                return 2
+
+    def _get_quadrants_near(self, point, epsilon):
+        '''
+        Return the quadrants that may hold points within epsilon of point.
+        '''
+        X = self.splitpoint[0]
+        Y = self.splitpoint[1]
+        x = point[0]
+        y = point[1]
+
+        # the same comparisons as _get_quadrant, for the whole epsilon box
+        right = x + epsilon >= X
+        left = x - epsilon < X
+        top = y + epsilon >= Y
+        bottom = y - epsilon < Y
+
+        quadrants = []
+        if top and left:
+            quadrants.append(self.quadrants[0])
+        if top and right:
+            quadrants.append(self.quadrants[1])
+        if bottom and left:
+            quadrants.append(self.quadrants[2])
+        if bottom and right:
+            quadrants.append(self.quadrants[3])
+        return quadrants
 
     def _is_split(self):
         return self.splitpoint is not None
@@ -176,6 +408,34 @@ class QuadtreeLeaf(object):
         self.position = position
         self.node = node
 
+def get_positions(node):
+    '''
+    Return the list of positions a Segment, Via or Module can be connected at.
+    '''
+    if isinstance(node, Segment):
+        return [node.get_start(), node.get_end()]
+    elif isinstance(node, Via):
+        return [node.get_position()]
+    elif isinstance(node, Module):
+        return node.get_pad_positions()
+    else:
+        raise Exception("Cannot insert")
+
+def get_position_layers(node):
+    '''
+    Return a list with the frozenset of copper layers of each position that
+    get_positions returns for node: a segment's layer for both of its ends,
+    every layer a via spans and the copper layers each pad lists.
+    '''
+    if isinstance(node, Segment):
+        return [get_copper_layers(node.layer)] * 2
+    elif isinstance(node, Via):
+        return [get_via_copper_layers(node.layers)]
+    elif isinstance(node, Module):
+        return [get_copper_layers(pad_layers) for pad_layers in node.get_pad_layers()]
+    else:
+        raise Exception("Cannot insert")
+
 def _mean(numbers):
     return float(sum(numbers)) / max(len(numbers), 1)
 
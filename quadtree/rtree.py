@@ -0,0 +1,146 @@
+'''
+A static R-tree of bounding boxes, packed with the Sort-Tile-Recursive
+algorithm and stored level by level in NumPy arrays.
+'''
+import heapq
+import math
+import numpy
+
+# number of entries per R-tree node
+NODE_SIZE = 16
+
+class RTree(object):
+    '''
+    An R-tree mapping bounding boxes (min x, min y, max x, max y) to values.
+
+    The boxes are sorted into tiles so that every run of NODE_SIZE boxes is
+    compact, and every level above is made of the bounding boxes of runs of
+    NODE_SIZE entries of the level below. The children of entry j on one
+    level are therefore entries j * NODE_SIZE to (j + 1) * NODE_SIZE - 1 on
+    the level below, and queries descend a level at a time with NumPy.
+    '''
+    def __init__(self, boxes, values):
+        boxes = numpy.array(boxes, dtype=float).reshape(-1, 4)
+        if len(boxes) != len(values):
+            raise Exception('Got %d boxes but %d values.' % (len(boxes), len(values)))
+
+        order = _sort_tile_recursive(boxes)
+        self._values = [values[i] for i in order.tolist()]
+        # levels[0] holds the boxes of the values, levels[-1] the root entries
+        self.levels = [boxes[order]]
+        while len(self.levels[-1]) > NODE_SIZE:
+            below = self.levels[-1]
+            starts = numpy.arange(0, len(below), NODE_SIZE)
+            self.levels.append(numpy.column_stack(
+                (numpy.minimum.reduceat(below[:, 0], starts),
+                 numpy.minimum.reduceat(below[:, 1], starts),
+                 numpy.maximum.reduceat(below[:, 2], starts),
+                 numpy.maximum.reduceat(below[:, 3], starts))))
+
+    def __len__(self):
+        return len(self._values)
+
+    def query(self, rectangle):
+        '''
+        Return the values whose boxes intersect rectangle, which is
+        (min x, min y, max x, max y).
+        '''
+        return self.query_many([rectangle])[0]
+
+    def query_many(self, rectangles):
+        '''
+        Query many rectangles at once. Returns a list with the list of values
+        for every rectangle.
+        '''
+        rectangles = numpy.array(rectangles, dtype=float).reshape(-1, 4)
+        found = [[] for _ in range(len(rectangles))]
+        if not len(self._values) or not len(rectangles):
+            return found
+
+        # (rectangle index, entry index) pairs, starting with every root entry
+        top = len(self.levels[-1])
+        query_indices = numpy.repeat(numpy.arange(len(rectangles)), top)
+        entry_indices = numpy.tile(numpy.arange(top), len(rectangles))
+        for level in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[level]
+            if level < len(self.levels) - 1:
+                # replace every entry of the level above by its children
+                query_indices = numpy.repeat(query_indices, NODE_SIZE)
+                entry_indices = (numpy.repeat(entry_indices * NODE_SIZE, NODE_SIZE) +
+                                 numpy.tile(numpy.arange(NODE_SIZE), len(entry_indices)))
+                exists = entry_indices < len(boxes)
+                query_indices = query_indices[exists]
+                entry_indices = entry_indices[exists]
+
+            entry_boxes = boxes[entry_indices]
+            query_rectangles = rectangles[query_indices]
+            intersects = ((entry_boxes[:, 0] <= query_rectangles[:, 2]) &
+                          (entry_boxes[:, 2] >= query_rectangles[:, 0]) &
+                          (entry_boxes[:, 1] <= query_rectangles[:, 3]) &
+                          (entry_boxes[:, 3] >= query_rectangles[:, 1]))
+            query_indices = query_indices[intersects]
+            entry_indices = entry_indices[intersects]
+
+        values = self._values
+        for query_index, entry_index in zip(query_indices.tolist(), entry_indices.tolist()):
+            found[query_index].append(values[entry_index])
+        return found
+
+    def nearest(self, position, k=1, accept=None):
+        '''
+        Return up to k values whose boxes are nearest to position, nearest
+        first. The distance to a box is 0 inside it. If accept is given, only
+        values for which accept(value) is true are returned.
+        '''
+        x, y = position[0], position[1]
+        values = self._values
+        top = len(self.levels) - 1
+        # (distance, level, entry index); the whole level below is pushed at once
+        heap = [(distance, top, index) for index, distance \
+                in enumerate(_get_distances(self.levels[top], x, y).tolist())]
+        heapq.heapify(heap)
+
+        found = []
+        while heap and len(found) < k:
+            _, level, index = heapq.heappop(heap)
+            if level == 0:
+                value = values[index]
+                if accept is None or accept(value):
+                    found.append(value)
+                continue
+            first = index * NODE_SIZE
+            children = self.levels[level - 1][first:first + NODE_SIZE]
+            for offset, distance in enumerate(_get_distances(children, x, y).tolist()):
+                heapq.heappush(heap, (distance, level - 1, first + offset))
+        return found
+
+    def nearest_many(self, positions, k=1, accept=None):
+        '''
+        Return a list with the result of nearest for every position.
+        '''
+        return [self.nearest(position, k, accept) for position in positions]
+
+def _get_distances(boxes, x, y):
+    dx = numpy.maximum(numpy.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = numpy.maximum(numpy.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    return numpy.hypot(dx, dy)
+
+def _sort_tile_recursive(boxes):
+    '''
+    Return the order in which to store boxes: sorted by x into vertical
+    slices of about sqrt(n / NODE_SIZE) nodes each, and by y within slices.
+    '''
+    count = len(boxes)
+    if not count:
+        return numpy.zeros(0, dtype=numpy.int64)
+    center_x = boxes[:, 0] + boxes[:, 2]
+    center_y = boxes[:, 1] + boxes[:, 3]
+
+    node_count = int(math.ceil(count / float(NODE_SIZE)))
+    slice_count = int(math.ceil(math.sqrt(node_count)))
+    slice_size = slice_count * NODE_SIZE
+
+    by_x = numpy.argsort(center_x, kind='mergesort')
+    slices = numpy.arange(count) // slice_size
+    # sort by slice first, then by y within each slice
+    return by_x[numpy.lexsort((center_y[by_x], slices))]
@@ -1,110 +1,101 @@
 '''
 Rotate components on Gaia PCB.
+
+Run it to rotate the Gaia board, or apply it to many boards with
+    python -m kicad_utils run rotate_keys.py --boards 'boards/*.kicad_pcb'
 '''
-from nodes.KicadPcbNode import parse_file, write_file
-from nodes.Module import find_modules, Module
-from nodes.Segment import find_segments
-from nodes.Via import find_vias
+from nodes.KicadPcbNode import parse_file, write_file, find_all
+from nodes.Module import Module, ModuleIndex
+from nodes.Segment import Segment
+from nodes.Via import Via
 import re
-from quadtree.quadtree import Quadtree
-from nodes.Transform2d import transform
+from quadtree.connectivity import ConnectivityGraph
+from nodes.Transform2d import transform, TransformSession
 
 # pylint: disable=all
 
 GAIA_PATH = '../keyboard/gaia/gaia.kicad_pcb'
 GAIA_OUTPUT = '../keyboard/gaia/gaia2.kicad_pcb'
 
-nodes = parse_file(GAIA_PATH)
-modules = find_modules(nodes)
-segments = find_segments(nodes)
-vias = find_vias(nodes)
-
-def get_modules(*module_names):
-    return [x for x in modules if x.name in module_names]
-
-quadtree = Quadtree()
-for module in modules:
-    quadtree.insert(module)
-for segment in segments:
-    quadtree.insert(segment)
-for via in vias:
-    quadtree.insert(via)
-
-# rotate thumb keys
-left_thumbs = get_modules('S5:5', 'S5:6')
-right_thumbs = get_modules('S5:7', 'S5:8')
-
-# get thumb pivots
-for module in modules:
-    if module.name == 'S4:5':
-        left_thumb_pivot_base = module.get_position()
-    elif module.name == 'S4:8':
-        right_thumb_pivot_base = module.get_position()
-    else:
-        continue
-
-left_thumb_pivot = (left_thumb_pivot_base[0] + 9.525,
-                    left_thumb_pivot_base[1] + 9.525)
-right_thumb_pivot = (right_thumb_pivot_base[0] - 9.525,
-                     right_thumb_pivot_base[1] + 9.525)
-
-left_thumbs = quadtree.get_connected(left_thumbs)
-right_thumbs = quadtree.get_connected(right_thumbs)
-
-for left_thumb_node in left_thumbs:
-    left_thumb_node.transform(r=-30, rp=left_thumb_pivot)
-    quadtree.update(left_thumb_node)
-
-for right_thumb_node in right_thumbs:
-    right_thumb_node.transform(r=30, rp=right_thumb_pivot)
-    quadtree.update(right_thumb_node)
-
-left_side = []
-right_side = []
-key_pattern = re.compile('[DS]([0-9]+):([0-9]+)')
-for module in modules:
-    match = key_pattern.match(module.name)
-    if match:
-        second_digit = int(match.group(2))
-        if second_digit <= 6:
-            left_side.append(module)
-        else:
-            right_side.append(module)
-left_side.extend(get_modules('SW1', 'Y1', 'C4', 'C5'))
-right_side.extend(get_modules('C6', 'C7'))
+def process(nodes):
+    '''Rotate the components of the parsed board nodes in place.'''
+    found = find_all(nodes, [Module, Segment, Via])
+    modules = found[Module]
+    segments = found[Segment]
+    vias = found[Via]
 
-# move right side such that S1:7 is 24.8063mm to the right of S1:6
-# center around IC3
-ic3 = [x for x in modules if x.name == 'IC3'][0]
-s1_6 = [x for x in modules if x.name == 'S1:6'][0]
-s1_7 = [x for x in modules if x.name == 'S1:7'][0]
-target_x_6 = ic3.x - (24.8063/2)
-target_x_7 = ic3.x + (24.8063/2)
-target_y = s1_6.y
-dx_6 = target_x_6 - s1_6.x
-dx_7 = target_x_7 - s1_7.x
-dy = target_y - s1_7.y
+    module_index = ModuleIndex(modules)
+    get_modules = module_index.get_modules
 
-left_side = quadtree.get_connected(left_side)
-right_side = quadtree.get_connected(right_side)
+    connectivity = ConnectivityGraph(modules + segments + vias)
 
-for left_side_node in left_side:
-    left_side_node.transform(t=(dx_6, dy))
-    quadtree.update(left_side_node)
+    # rotate thumb keys
+    left_thumbs = get_modules('S5:5', 'S5:6')
+    right_thumbs = get_modules('S5:7', 'S5:8')
 
-for right_side_node in right_side:
-    right_side_node.transform(t=(dx_7, dy))
-    quadtree.update(right_side_node)
+    # get thumb pivots
+    left_thumb_pivot_base = module_index.get('S4:5').get_position()
+    right_thumb_pivot_base = module_index.get('S4:8').get_position()
 
+    left_thumb_pivot = (left_thumb_pivot_base[0] + 9.525,
+                        left_thumb_pivot_base[1] + 9.525)
+    right_thumb_pivot = (right_thumb_pivot_base[0] - 9.525,
+                         right_thumb_pivot_base[1] + 9.525)
 
-# tilt sides up 10 degrees
+    left_thumbs = connectivity.get_connected(left_thumbs)
+    right_thumbs = connectivity.get_connected(right_thumbs)
 
-left_pivot = (s1_6.x, s1_6.y)
-for left_side_node in left_side:
-    left_side_node.transform(r=-10, rp=left_pivot)
+    transform(left_thumbs, r=-30, rp=left_thumb_pivot)
+    connectivity.update(left_thumbs)
 
-right_pivot = (s1_7.x, s1_7.y)
-for right_side_node in right_side:
-    right_side_node.transform(r=10, rp=right_pivot)
+    transform(right_thumbs, r=30, rp=right_thumb_pivot)
+    connectivity.update(right_thumbs)
 
-write_file(GAIA_OUTPUT, nodes)
+    left_side = []
+    right_side = []
+    key_pattern = re.compile('[DS]([0-9]+):([0-9]+)')
+    for module in module_index.matching(key_pattern):
+        second_digit = int(key_pattern.match(module.name).group(2))
+        if second_digit <= 6:
+            left_side.append(module)
+        else:
+            right_side.append(module)
+    left_side.extend(get_modules('SW1', 'Y1', 'C4', 'C5'))
+    right_side.extend(get_modules('C6', 'C7'))
+
+    # move right side such that S1:7 is 24.8063mm to the right of S1:6
+    # center around IC3
+    ic3 = module_index.get('IC3')
+    s1_6 = module_index.get('S1:6')
+    s1_7 = module_index.get('S1:7')
+    target_x_6 = ic3.x - (24.8063/2)
+    target_x_7 = ic3.x + (24.8063/2)
+    target_y = s1_6.y
+    dx_6 = target_x_6 - s1_6.x
+    dx_7 = target_x_7 - s1_7.x
+    dy = target_y - s1_7.y
+
+    left_side = connectivity.get_connected(left_side)
+    right_side = connectivity.get_connected(right_side)
+
+    # move and tilt each side in one step, so that it is only rounded once
+    session = TransformSession()
+    session.transform(left_side, t=(dx_6, dy))
+    session.transform(right_side, t=(dx_7, dy))
+
+    # tilt sides up 10 degrees
+
+    left_pivot = session.transform_point(s1_6, s1_6.x, s1_6.y)
+    session.transform(left_side, r=-10, rp=left_pivot)
+
+    right_pivot = session.transform_point(s1_7, s1_7.x, s1_7.y)
+    session.transform(right_side, r=10, rp=right_pivot)
+
+    # each side moved as a whole, but the sides moved differently
+    for batch in session.commit():
+        connectivity.update(batch)
+
+if __name__ == '__main__':
+    nodes = parse_file(GAIA_PATH)
+    process(nodes)
+    write_file(GAIA_OUTPUT, nodes)
@@ -1,12 +1,15 @@
 '''
 Rotate components on Gaia PCB.
+
+Run it to rotate the Gaia board, or apply it to many boards with
+    python -m kicad_utils run rotate_thumbs.py --boards 'boards/*.kicad_pcb'
 '''
-from nodes.KicadPcbNode import parse_file, write_file
-from nodes.Module import find_modules, Module
-from nodes.Segment import find_segments
-from nodes.Via import find_vias
+from nodes.KicadPcbNode import parse_file, write_file, find_all
+from nodes.Module import Module, ModuleIndex
+from nodes.Segment import Segment
+from nodes.Via import Via
 import re
-from quadtree.quadtree import Quadtree
+from quadtree.connectivity import ConnectivityGraph
 from nodes.Transform2d import transform
 
 # pylint: disable=all
@@ -14,49 +17,41 @@ from nodes.Transform2d import transform
 GAIA_PATH = '../keyboard/gaia/gaia.kicad_pcb'
 GAIA_OUTPUT = '../keyboard/gaia/gaia2.kicad_pcb'
 
-nodes = parse_file(GAIA_PATH)
-modules = find_modules(nodes)
-segments = find_segments(nodes)
-vias = find_vias(nodes)
-
-def get_modules(*module_names):
-    return [x for x in modules if x.name in module_names]
-
-quadtree = Quadtree()
-for module in modules:
-    quadtree.insert(module)
-for segment in segments:
-    quadtree.insert(segment)
-for via in vias:
-    quadtree.insert(via)
-
-# rotate thumb keys
-left_thumbs = get_modules('S5:5', 'S5:6')
-right_thumbs = get_modules('S5:7', 'S5:8')
-
-# get thumb pivots
-for module in modules:
-    if module.name == 'S4:5':
-        left_thumb_pivot_base = module.get_position()
-    elif module.name == 'S4:8':
-        right_thumb_pivot_base = module.get_position()
-    else:
-        continue
-
-left_thumb_pivot = (left_thumb_pivot_base[0] + 9.525,
-                    left_thumb_pivot_base[1] + 9.525)
-right_thumb_pivot = (right_thumb_pivot_base[0] - 9.525,
-                     right_thumb_pivot_base[1] + 9.525)
-
-left_thumbs = quadtree.get_connected(left_thumbs)
-right_thumbs = quadtree.get_connected(right_thumbs)
-
-for left_thumb_node in left_thumbs:
-    left_thumb_node.transform(r=-30, rp=left_thumb_pivot)
-    quadtree.update(left_thumb_node)
-
-for right_thumb_node in right_thumbs:
-    right_thumb_node.transform(r=30, rp=right_thumb_pivot)
-    quadtree.update(right_thumb_node)
-
-write_file(GAIA_OUTPUT, nodes)
+def process(nodes):
+    '''Rotate the components of the parsed board nodes in place.'''
+    found = find_all(nodes, [Module, Segment, Via])
+    modules = found[Module]
+    segments = found[Segment]
+    vias = found[Via]
+
+    module_index = ModuleIndex(modules)
+    get_modules = module_index.get_modules
+
+    connectivity = ConnectivityGraph(modules + segments + vias)
+
+    # rotate thumb keys
+    left_thumbs = get_modules('S5:5', 'S5:6')
+    right_thumbs = get_modules('S5:7', 'S5:8')
+
+    # get thumb pivots
+    left_thumb_pivot_base = module_index.get('S4:5').get_position()
+    right_thumb_pivot_base = module_index.get('S4:8').get_position()
+
+    left_thumb_pivot = (left_thumb_pivot_base[0] + 9.525,
+                        left_thumb_pivot_base[1] + 9.525)
+    right_thumb_pivot = (right_thumb_pivot_base[0] - 9.525,
+                         right_thumb_pivot_base[1] + 9.525)
+
+    left_thumbs = connectivity.get_connected(left_thumbs)
+    right_thumbs = connectivity.get_connected(right_thumbs)
+
+    transform(left_thumbs, r=-30, rp=left_thumb_pivot)
+    connectivity.update(left_thumbs)
+
+    transform(right_thumbs, r=30, rp=right_thumb_pivot)
+    connectivity.update(right_thumbs)
+
+if __name__ == '__main__':
+    nodes = parse_file(GAIA_PATH)
+    process(nodes)
+    write_file(GAIA_OUTPUT, nodes)
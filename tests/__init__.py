@@ -0,0 +1,6 @@
+'''
+Tests for kicad_utils.
+
+Run them from the repository root with
+    python -m unittest discover -s tests -t .
+'''
@@ -0,0 +1,85 @@
+'''
+Tests for kicad_utils.batch.
+'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from kicad_utils import batch
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+SCRIPT = '''
+from nodes.KicadPcbNode import find_all
+from nodes.Module import Module
+
+def process(nodes):
+    for module in find_all(nodes, [Module])[Module]:
+        module.transform(t=(1, 0))
+'''
+
+BROKEN_SCRIPT = '''
+raise ValueError('broken script')
+'''
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+        self.boards = []
+        for i in range(2):
+            board_path = os.path.join(self.work_dir, 'board%d.kicad_pcb' % i)
+            shutil.copy(TEST_INPUT, board_path)
+            self.boards.append(board_path)
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        batch._process = None
+        batch._load_error = None
+        shutil.rmtree(self.work_dir)
+
+    def _write_script(self, text):
+        script_path = os.path.join(self.work_dir, 'script.py')
+        with open(script_path, 'w') as script_file:
+            script_file.write(text)
+        return script_path
+
+    def _main(self, *args):
+        return batch.main(['kicad_utils', 'run'] + list(args) +
+                          ['--boards', os.path.join(self.work_dir, '*.kicad_pcb')])
+
+    def test_run(self):
+        out = StringIO()
+        failed = batch.run(self._write_script(SCRIPT), self.boards, jobs=2,
+                           output_dir=os.path.join(self.work_dir, 'out'), out=out)
+        self.assertEqual(failed, 0, out.getvalue())
+        for board_path in self.boards:
+            self.assertTrue(os.path.exists(batch.get_output_path(
+                board_path, os.path.join(self.work_dir, 'out'))))
+
+    def test_broken_script(self):
+        # a script that fails to load is reported once, before the workers start
+        for jobs in ('1', '2'):
+            self.assertEqual(self._main(self._write_script(BROKEN_SCRIPT), '--jobs', jobs), 2)
+            self.assertIn('broken script', sys.stderr.getvalue())
+        self.assertEqual([name for name in os.listdir(self.work_dir) if '-out' in name], [])
+
+    def test_lazy_with_cache(self):
+        with self.assertRaises(SystemExit) as context:
+            self._main(self._write_script(SCRIPT), '--engine', 'lazy', '--cache')
+        self.assertEqual(context.exception.code, 2)
+        self.assertIn('--cache', sys.stderr.getvalue())
+
+    def test_worker_load_error(self):
+        batch._init_worker(os.path.join(self.work_dir, 'missing.py'))
+        _, _, times, error = batch._run_task((self.boards[0], self.boards[0] + '.out',
+                                              'tokenizer', False))
+        self.assertIsNone(times)
+        self.assertIn('missing.py', error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Tests for copying and pickling KicadPcbNode trees.
+'''
+import copy
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from nodes.KicadPcbNode import KicadPcbNode, parse_file, write_file
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+class CopyTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _write(self, nodes, name):
+        path = os.path.join(self.work_dir, name)
+        write_file(path, nodes)
+        with open(path, 'rb') as written_file:
+            return written_file.read()
+
+    def _check_copy(self, make_copy):
+        # lazily parsed trees are written verbatim, copies are written out
+        expected = self._write(parse_file(TEST_INPUT), 'original')
+        for engine in ('tokenizer', 'lazy'):
+            nodes = parse_file(TEST_INPUT, engine=engine)
+            copied = make_copy(nodes)
+            self.assertEqual(self._write(copied, 'copy'), expected)
+
+            # the copy's child lists still keep the name index up to date
+            root = copied[0]
+            self.assertEqual(len(root.get_children_with_name('module')), 1)
+            root.add_named_child('module', [])
+            self.assertEqual(len(root.get_children_with_name('module')), 2)
+            self.assertEqual(len(nodes[0].get_children_with_name('module')), 1)
+
+    def test_deepcopy(self):
+        self._check_copy(copy.deepcopy)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self._check_copy(lambda nodes: pickle.loads(pickle.dumps(nodes, protocol)))
+
+    def test_copy_child_list(self):
+        node = KicadPcbNode('at')
+        node.children = [1.0, 2.0]
+        self.assertEqual(copy.deepcopy(node.children), [1.0, 2.0])
+        self.assertEqual(pickle.loads(pickle.dumps(node.children, 2)), [1.0, 2.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+'''
+Tests for how Module writes its position and rotation back to the board, and
+for ModuleIndex.
+'''
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from nodes.KicadPcbNode import parse_file, parse_string, write_file, find_all
+from nodes.Module import Module, ModuleIndex, _get_literal_prefixes
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+class WriteBackTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _transform_and_write(self, engine, **kwargs):
+        '''
+        Transform the module of test_input, write the board and return the
+        written text and the module parsed back from it.
+        '''
+        nodes = parse_file(TEST_INPUT, engine=engine)
+        find_all(nodes, [Module])[Module][0].transform(**kwargs)
+        path = os.path.join(self.work_dir, 'output.kicad_pcb')
+        write_file(path, nodes)
+        with open(path, 'rb') as output_file:
+            text = output_file.read()
+        return (text, find_all(parse_file(path), [Module])[Module][0])
+
+    @staticmethod
+    def _get_child_ats(module):
+        return [child.get_child_with_name('at').children for child in module._node.children \
+                if hasattr(child, 'name') and child.name in ('fp_text', 'pad')]
+
+    def test_translate_leaves_children(self):
+        # A translation rewrites the module's own 'at' (with its rotation),
+        # but pads and texts are relative to it and are left as written,
+        # rather than getting a rotation of 0 added.
+        for engine in ('tokenizer', 'lazy'):
+            text, module = self._transform_and_write(engine, t=(1, 2))
+            self.assertEqual(module._node.get_child_with_name('at').children,
+                             [264.525, 200.4375, 0])
+            self.assertEqual(self._get_child_ats(module), [[0, 2.1], [0, 6], [-1.25, 0]])
+        # the lazy engine copies everything but the module's 'at' verbatim
+        self.assertIn('  (module bwu-keyboard:bwu-electrolyte-capacitor-0805 (layer F.Cu) '
+                      '(tedit 55C98A20) (tstamp 599A74A3)\r\n    (at 264.525 200.4375 0)\r\n'
+                      '    (fp_text value 1\xc2\xb5F (at 0 2.1) (layer F.Fab)\r\n', text)
+
+    def test_rotate_rotates_children(self):
+        for engine in ('tokenizer', 'lazy'):
+            _, module = self._transform_and_write(engine, r=90, rp=(263.525, 198.4375))
+            self.assertEqual(module._node.get_child_with_name('at').children,
+                             [263.525, 198.4375, 90])
+            self.assertEqual(self._get_child_ats(module),
+                             [[0, 2.1, 90], [0, 6, 90], [-1.25, 0, 90]])
+
+MODULE_TEMPLATE = '''
+(module test:PAD (layer F.Cu)
+  (at 0 0)
+  (fp_text reference %s (at 0 0) (layer F.SilkS))
+)
+'''
+
+NAMES = ['SW1', 'SW2', 'SW10', 'S1:1', 'S1:6', 'S12:3', 'D1', 'D2', 'D10', 'DS1',
+         'R1', 'R2', 'C1', 'U1', 'U10', 'J1', 'SW1']
+
+PATTERNS = ['S([0-9]+):([0-9]+)', '[DS]([0-9]+)', '[DS]([0-9]+)$', 'SW1', 'SW1$', 'SW1*',
+            'S?W', 'R|C', 'R1|U', '(?:D|U)1', 'U[0-9]', '[^S]', '[A-Z]W', '.*', '', r'S\d', '(?i)sw',
+            'D[1-3]']
+
+class ModuleIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.modules = [Module(parse_string(MODULE_TEMPLATE % name)[0]) for name in NAMES]
+        self.index = ModuleIndex(self.modules)
+
+    def test_literal_prefixes(self):
+        self.assertEqual(_get_literal_prefixes(re.compile('S([0-9]+):([0-9]+)')), ['S'])
+        self.assertEqual(_get_literal_prefixes(re.compile('[DS]([0-9]+)')), ['D', 'S'])
+        self.assertEqual(_get_literal_prefixes(re.compile('SW1*')), ['SW'])
+        # sre_parse turns single character alternatives into a class
+        self.assertEqual(sorted(_get_literal_prefixes(re.compile('R|C'))), ['C', 'R'])
+        self.assertEqual(_get_literal_prefixes(re.compile('R1|U')), [''])
+        self.assertEqual(_get_literal_prefixes(re.compile('(?i)sw')), [''])
+
+    def test_matching(self):
+        # every prefix the index narrows a query to has to keep all matches
+        for pattern in PATTERNS:
+            expected = [m for m in self.modules if re.match(pattern, m.name)]
+            self.assertEqual(self.index.matching(pattern), expected, pattern)
+            self.assertEqual(self.index.matching(re.compile(pattern)), expected, pattern)
+
+    def test_with_prefix(self):
+        for prefix in ('', 'S', 'SW1', 'S1:', 'D', 'X'):
+            self.assertEqual(self.index.with_prefix(prefix),
+                             [m for m in self.modules if m.name.startswith(prefix)], prefix)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+'''
+Tests for nodes.ParseCache and parse_file(cache=...).
+'''
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from nodes.KicadPcbNode import parse_file, write_file
+from nodes.ParseCache import ParseCache
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+        self.handler = _RecordingHandler()
+        logging.getLogger('nodes').addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger('nodes').removeHandler(self.handler)
+        shutil.rmtree(self.work_dir)
+
+    def _write(self, nodes):
+        path = os.path.join(self.work_dir, 'output.kicad_pcb')
+        write_file(path, nodes)
+        with open(path, 'rb') as output_file:
+            return output_file.read()
+
+    def test_round_trip(self):
+        cache = ParseCache(os.path.join(self.work_dir, 'cache'))
+        expected = self._write(parse_file(TEST_INPUT))
+        self.assertIsNone(cache.load(TEST_INPUT))
+        self.assertEqual(self._write(parse_file(TEST_INPUT, cache=cache)), expected)
+        # the second parse comes from the cache
+        self.assertIsNotNone(cache.load(TEST_INPUT))
+        self.assertEqual(self._write(parse_file(TEST_INPUT, cache=cache)), expected)
+
+    def test_store_failure_is_not_fatal(self):
+        # a file where the cache directory should be makes every store fail
+        cache_dir = os.path.join(self.work_dir, 'cache')
+        open(cache_dir, 'w').close()
+        nodes = parse_file(TEST_INPUT, cache=ParseCache(cache_dir))
+        self.assertEqual(self._write(nodes), self._write(parse_file(TEST_INPUT)))
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertIn('Could not store', self.handler.messages[0])
+
+    def test_touch_failure_is_not_fatal(self):
+        cache = ParseCache(os.path.join(self.work_dir, 'cache'))
+        parse_file(TEST_INPUT, cache=cache)
+
+        def _fail(path, times):
+            raise OSError(30, 'Read-only file system')
+        utime = os.utime
+        os.utime = _fail
+        try:
+            self.assertIsNotNone(cache.load(TEST_INPUT))
+        finally:
+            os.utime = utime
+        self.assertEqual(len(self.handler.messages), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+'''
+Tests for quadtree.Quadtree lookups, checked against a brute force search,
+and for Quadtree.get_connected, checked against a ConnectivityGraph.
+
+The points are scattered in tight clusters, so that many of them are within
+epsilon of each other and of the split points of the tree. Some of them are
+then moved, one at a time and in groups, both just a little and far away.
+'''
+import math
+import random
+import unittest
+from collections import Counter
+from nodes.KicadPcbNode import find_all, parse_string
+from nodes.Module import Module
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.Transform2d import transform
+from quadtree.quadtree import Quadtree, EPSILON
+from quadtree.connectivity import ConnectivityGraph
+from benchmarks.synthetic import generate_board, MODULE_PITCH, PAD_PITCH
+
+TRIALS = 4
+POINTS = 150
+
+def _random_position(rng, centers, epsilon):
+    center_x, center_y = rng.choice(centers)
+    return (round(center_x + rng.uniform(-2, 2) * epsilon, 5),
+            round(center_y + rng.uniform(-2, 2) * epsilon, 5))
+
+def _intersects(box, rectangle):
+    return box[0] <= rectangle[2] and box[2] >= rectangle[0] and \
+           box[1] <= rectangle[3] and box[3] >= rectangle[1]
+
+def _box_distance(box, position):
+    return math.hypot(max(box[0] - position[0], position[0] - box[2], 0),
+                      max(box[1] - position[1], position[1] - box[3], 0))
+
+def _ids(nodes):
+    return Counter(id(node) for node in nodes)
+
+def _make_trials():
+    '''
+    Return a list of (vias, {name: Quadtree}, queries) for every trial.
+    '''
+    rng = random.Random(0)
+    trials = []
+    for _ in range(TRIALS):
+        centers = [(rng.uniform(-50, 50), rng.uniform(-50, 50)) for _ in range(POINTS // 8 + 1)]
+        vias = [Via.new_via(position=_random_position(rng, centers, EPSILON), net=1) \
+                for _ in range(POINTS)]
+
+        incremental = Quadtree()
+        for via in vias:
+            incremental.insert(via)
+        quadtrees = {'incremental': incremental,
+                     'bulk_load': Quadtree.bulk_load(vias),
+                     'hashgrid': Quadtree.bulk_load(vias, backend='hashgrid')}
+
+        for via in rng.sample(vias, len(vias) // 10):
+            via.transform(t=(rng.uniform(-EPSILON, EPSILON), rng.uniform(-EPSILON, EPSILON)))
+            for quadtree in quadtrees.values():
+                quadtree.update(via)
+        for distance in (EPSILON, 10, 100):
+            group = rng.sample(vias, len(vias) // 5)
+            transform(group, t=(rng.uniform(-distance, distance), rng.uniform(-distance, distance)))
+            for quadtree in quadtrees.values():
+                quadtree.bulk_update(group)
+
+        queries = [_random_position(rng, centers, EPSILON) for _ in range(POINTS)]
+        trials.append((vias, quadtrees, queries))
+    return trials
+
+class LookupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.trials = _make_trials()
+
+    def test_lookup(self):
+        for vias, quadtrees, queries in self.trials:
+            many = quadtrees['bulk_load'].lookup_many(queries)
+            for query, found_many in zip(queries, many):
+                expected = _ids(via for via in vias \
+                                if math.hypot(via.position[0] - query[0],
+                                              via.position[1] - query[1]) <= EPSILON)
+                self.assertEqual(_ids(found_many), expected)
+                for name, quadtree in sorted(quadtrees.items()):
+                    self.assertEqual(_ids(quadtree.lookup(query)), expected, name)
+
+    def test_query_rectangles(self):
+        for vias, quadtrees, queries in self.trials:
+            rectangles = [(x - 1, y - 1, x + 1, y + 1) for x, y in queries]
+            for name, quadtree in sorted(quadtrees.items()):
+                for rectangle, found in zip(rectangles, quadtree.query_rectangles(rectangles)):
+                    expected = [via for via in vias \
+                                if _intersects(via.get_bounding_box(), rectangle)]
+                    self.assertEqual(_ids(found), _ids(expected), name)
+
+    def test_nearest(self):
+        for vias, quadtrees, queries in self.trials:
+            for name, quadtree in sorted(quadtrees.items()):
+                for query, found in zip(queries, quadtree.nearest_many(queries, k=3)):
+                    distances = sorted(_box_distance(via.get_bounding_box(), query) \
+                                       for via in vias)[:3]
+                    # ties may come in any order; only the distances have to match
+                    self.assertEqual([_box_distance(via.get_bounding_box(), query) \
+                                      for via in found], distances, name)
+
+MODULE_TEXT = '''
+(module test:PAD (layer F.Cu)
+  (at 0 0)
+  (fp_text reference M1 (at 0 0) (layer F.SilkS))
+  (pad 1 smd rect (at 0 0) (size 1 1) (layers F.Cu) (net 1 /N1))
+)
+'''
+
+def _build_quadtrees(nodes):
+    incremental = Quadtree()
+    for node in nodes:
+        incremental.insert(node)
+    return {'incremental': incremental,
+            'bulk_load': Quadtree.bulk_load(nodes),
+            'hashgrid': Quadtree.bulk_load(nodes, backend='hashgrid')}
+
+class GetConnectedTest(unittest.TestCase):
+    def test_same_as_connectivity_graph(self):
+        rng = random.Random(0)
+        found = find_all(generate_board(modules=30, segments=240, vias=30),
+                         [Module, Segment, Via])
+        board_objects = found[Module] + found[Segment] + found[Via]
+        quadtrees = _build_quadtrees(board_objects)
+
+        # move groups by whole pitches, so that they land on other pads and
+        # tracks, and by odd amounts, so that they leave them
+        for _ in range(3):
+            group = rng.sample(board_objects, 40)
+            if rng.random() < 0.5:
+                transform(group, t=(rng.randint(-1, 1) * MODULE_PITCH,
+                                    rng.randint(-1, 1) * PAD_PITCH))
+            else:
+                transform(group, t=(rng.uniform(-5, 5), rng.uniform(-5, 5)), r=10)
+            for quadtree in quadtrees.values():
+                quadtree.bulk_update(group)
+
+        connectivity = ConnectivityGraph(board_objects)
+        for module in found[Module]:
+            expected = connectivity.get_connected([module], (Module, Segment, Via))
+            for name, quadtree in sorted(quadtrees.items()):
+                self.assertEqual(quadtree.get_connected([module], (Module, Segment, Via)),
+                                 expected, name)
+
+    def test_layers(self):
+        module = Module(parse_string(MODULE_TEXT)[0])
+        front = Segment.new_segment(start=(0, 0), end=(5, 0), layer='F.Cu', net=1)
+        back = Segment.new_segment(start=(5, 0), end=(10, 0), layer='B.Cu', net=1)
+        via = Via.new_via(position=(10, 0), net=1)
+        beyond = Segment.new_segment(start=(10, 0), end=(10, 5), layer='F.Cu', net=1)
+        for name, quadtree in sorted(_build_quadtrees([module, front, back, via, beyond]).items()):
+            # back only meets front on another layer
+            self.assertEqual(quadtree.get_connected([module]), set([module, front]), name)
+            self.assertEqual(quadtree.get_connected([module], (Module,)), set([module]), name)
+
+    def test_module_not_in_quadtree(self):
+        module = Module(parse_string(MODULE_TEXT)[0])
+        front = Segment.new_segment(start=(0, 0), end=(5, 0), layer='F.Cu', net=1)
+        for name, quadtree in sorted(_build_quadtrees([front]).items()):
+            self.assertEqual(quadtree.get_connected([module]), set([module, front]), name)
+        self.assertEqual(Quadtree().get_connected([module]), set([module]))
+
+if __name__ == '__main__':
+    unittest.main()
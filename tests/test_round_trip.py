@@ -0,0 +1,116 @@
+'''
+Round trip tests of the parse engines and writers against the parser and
+writer of the first commit of the repository, on test_input and on a small
+synthetic board.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks.node_memory import load_baseline, get_first_rev
+from benchmarks.synthetic import write_board
+from nodes.KicadPcbNode import parse_file, write_file, find_all
+from nodes.Module import Module
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.ParseCache import ParseCache
+from nodes.Transform2d import transform
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+def _read(path):
+    with open(path, 'rb') as input_file:
+        return input_file.read()
+
+def _edit(nodes):
+    '''
+    Change a board the ways scripts do: transform modules, segments and
+    vias, and add and remove children of nodes.
+    '''
+    found = find_all(nodes, [Module, Segment, Via])
+    modules = found[Module]
+    transform(modules[:2], t=(1.5, -2), r=90, rp=(10, 10))
+    modules[-1].transform(t=(0, 3.25))
+    for segment in found[Segment][::7]:
+        segment.transform(t=(0.5, 0))
+    for via in found[Via][::5]:
+        via.transform(r=-10, rp=(0, 0))
+    modules[-1]._node.add_named_child('tags', ['round_trip'])
+    del modules[0]._node.children[-1]
+
+class RoundTripTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+        cls.baseline = load_baseline(get_first_rev(), cls.work_dir)
+        synthetic = os.path.join(cls.work_dir, 'synthetic.kicad_pcb')
+        write_board(synthetic, modules=20, segments=100, vias=20)
+        cls.boards = [TEST_INPUT, synthetic]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def _write(self, nodes):
+        path = os.path.join(self.work_dir, 'output.kicad_pcb')
+        write_file(path, nodes)
+        return _read(path)
+
+    def _write_baseline(self, board):
+        ''' Return board as parsed and written by the baseline. '''
+        path = os.path.join(self.work_dir, 'baseline.kicad_pcb')
+        self.baseline.write_file(path, self.baseline.parse_file(board))
+        return _read(path)
+
+    def _check_engine(self, **kwargs):
+        for board in self.boards:
+            self.assertEqual(self._write(parse_file(board, **kwargs)),
+                             self._write_baseline(board), board)
+
+    def test_tokenizer(self):
+        self._check_engine(engine='tokenizer')
+
+    def test_shlex(self):
+        self._check_engine(engine='shlex')
+
+    def test_parallel(self):
+        self._check_engine(workers=2)
+
+    def test_parse_cache(self):
+        cache = ParseCache(os.path.join(self.work_dir, 'cache'))
+        try:
+            # the first parse fills the cache, the second one reads it
+            self._check_engine(cache=cache)
+            for board in self.boards:
+                self.assertIsNotNone(cache.load(board))
+            self._check_engine(cache=cache)
+        finally:
+            shutil.rmtree(cache.cache_dir)
+
+    def test_lazy(self):
+        for board in self.boards:
+            text = self._write(parse_file(board, engine='lazy'))
+            # untouched boards are copied verbatim
+            self.assertEqual(text, _read(board))
+            path = os.path.join(self.work_dir, 'lazy.kicad_pcb')
+            with open(path, 'wb') as lazy_file:
+                lazy_file.write(text)
+            self.assertEqual(self._write_baseline(path), self._write_baseline(board))
+
+    def test_lazy_changes(self):
+        for board in self.boards:
+            nodes = parse_file(board)
+            _edit(nodes)
+            expected = self._write(nodes)
+
+            nodes = parse_file(board, engine='lazy')
+            _edit(nodes)
+            path = os.path.join(self.work_dir, 'lazy.kicad_pcb')
+            write_file(path, nodes)
+            # only the changed nodes are rewritten, so compare what the
+            # baseline makes of the file
+            self.assertEqual(self._write_baseline(path), expected, board)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+'''
+Tests for nodes.Transform2d.TransformSession.
+'''
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from nodes.KicadPcbNode import parse_file, parse_string, write_file, find_all
+from nodes.Module import Module
+from nodes.Segment import Segment
+from nodes.Via import Via
+from nodes.Transform2d import TransformSession, get_open_sessions, transform
+
+TEST_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_input')
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+
+    def tearDown(self):
+        for session in get_open_sessions():
+            session.discard()
+        shutil.rmtree(self.work_dir)
+
+    def _write_and_get_position(self, nodes, file_name):
+        path = os.path.join(self.work_dir, file_name)
+        write_file(path, nodes)
+        return find_all(parse_file(path), [Module])[Module][0].get_position()
+
+    def _start_session(self, module, t):
+        session = TransformSession()
+        session.transform([module], t=t)
+
+    def test_write_commits_dropped_session(self):
+        for engine in ('tokenizer', 'lazy'):
+            nodes = parse_file(TEST_INPUT, engine=engine)
+            module = find_all(nodes, [Module])[Module][0]
+            x, y = module.get_position()
+            # the session goes out of scope without being committed
+            self._start_session(module, (1, 2))
+            self.assertEqual(self._write_and_get_position(nodes, 'output.kicad_pcb'),
+                             (x + 1, y + 2))
+            self.assertEqual(get_open_sessions(), [])
+
+    def test_write_leaves_sessions_of_other_trees(self):
+        nodes = parse_file(TEST_INPUT)
+        other_nodes = parse_file(TEST_INPUT)
+        module = find_all(nodes, [Module])[Module][0]
+        other_module = find_all(other_nodes, [Module])[Module][0]
+        position = other_module.get_position()
+
+        session = TransformSession()
+        session.transform([module], t=(1, 2))
+        other_session = TransformSession()
+        other_session.transform([other_module], t=(3, 4))
+
+        self._write_and_get_position(nodes, 'output.kicad_pcb')
+        self.assertEqual(get_open_sessions(), [other_session])
+        self.assertEqual(other_module.get_position(), position)
+        self.assertEqual(self._write_and_get_position(other_nodes, 'other.kicad_pcb'),
+                         (position[0] + 3, position[1] + 4))
+
+MODULE_TEXT = '''
+(module test:PAD (layer F.Cu)
+  (at 0 1)
+  (fp_text reference M1 (at 0 0) (layer F.SilkS))
+  (pad 1 smd rect (at 0 0) (size 1 1) (layers F.Cu) (net 1 /N1))
+)
+'''
+
+class TransformPathTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kicad_utils_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    @staticmethod
+    def _new_objects():
+        # rotating a coordinate of 0 by 180 degrees gives -0.0 before rounding
+        return [Module(parse_string(MODULE_TEXT)[0]),
+                Segment.new_segment(start=(0, 1), end=(2, 0), layer='F.Cu', net=1),
+                Via.new_via(position=(0, 1), net=1)]
+
+    def _write(self, objects):
+        path = os.path.join(self.work_dir, 'output.kicad_pcb')
+        write_file(path, [o._node for o in objects])
+        with open(path, 'rb') as output_file:
+            return output_file.read()
+
+    def test_paths_agree(self):
+        one_by_one = self._new_objects()
+        for o in one_by_one:
+            o.transform(r=180)
+        batched = self._new_objects()
+        transform(batched, r=180)
+        session = self._new_objects()
+        with TransformSession() as s:
+            s.transform(session, r=180)
+
+        text = self._write(one_by_one)
+        self.assertIsNone(re.search(r'-0\.0[ )]', text))
+        self.assertEqual(self._write(batched), text)
+        self.assertEqual(self._write(session), text)
+
+if __name__ == '__main__':
+    unittest.main()